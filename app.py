@@ -2,11 +2,10 @@ from __future__ import annotations
 import os 
 import streamlit as st
 from dotenv import load_dotenv
-from openai import OpenAI
 
 from safety import crisis_check, crisis_response
-from rag import load_cards, retrieve_cards, retrieve_combined_context
-from prompts import SYSTEM_PROMPT, format_cards_for_prompt, format_combined_context
+from rag import get_cards, retrieve_cards, retrieve_combined_context, start_warm_up
+from prompts import SYSTEM_PROMPT, format_cards_for_prompt, format_card_catalog, format_turn_context
 from schema import COACH_OUTPUT_SCHEMA
 from timeline_page import render_timeline
 from emotions_page import render_emotions
@@ -22,16 +21,29 @@ import html
 import base64
 import uuid 
 from emotion_logger import log_turn
+from llm_gateway import JsonStringFieldStream, chat_completion, stream_chat_completion, usage_report
+from conversation_context import bounded_history, build_messages, start_folding
 
 
 load_dotenv()
 
+# Stream assistant replies into the chat bubble as they are generated (set STREAM_REPLIES=0 to wait for the full reply)
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "1") != "0"
+
 st.set_page_config(
     page_title="TeenMind Coach", 
     page_icon="💬", 
     initial_sidebar_state="collapsed"
 )
 
+# Build the retrieval index in the background once per server process, so it is ready
+# before the first chat turn (and warms up while the user is still logging in)
+@st.cache_resource
+def start_rag_warm_up():
+    return start_warm_up()
+
+start_rag_warm_up()
+
 # Authentication check - must be logged in to use the app
 if not is_authenticated():
     render_auth_page()
@@ -352,8 +364,8 @@ except Exception:
     user_avatar_bytes = None
 
 
-# Load RAG cards once
-cards = load_cards()
+# Shared RAG cards, loaded once per process by the warm-up
+cards = get_cards()
 
 # Emotions analytics page
 if st.session_state.get("page") == "emotions":
@@ -1068,57 +1080,37 @@ def _render_message_with_avatar(msg: dict):
                 st.markdown("🙂")
             st.markdown("<p style='text-align: center; font-size: 0.75rem; color: #6b8e7f; margin-top: 4px; margin-left: -10px;'>me</p>", unsafe_allow_html=True)
     with col_msg:
-        # Escape user content to avoid HTML injection and preserve newlines
-        safe = html.escape(content)
-        safe = safe.replace('\n', '<br/>')
-        bubble_class = 'assistant' if role == 'assistant' else 'user'
-        st.markdown(f'<div class="chat-bubble {bubble_class}">{safe}</div>', unsafe_allow_html=True)
+        bubble = st.empty()
+        bubble.markdown(_chat_bubble_html(role, content), unsafe_allow_html=True)
     st.markdown('</div>', unsafe_allow_html=True)
+    return bubble
 
-def call_model(user_message: str, rag_context: str, conversation_history: list = None) -> str:
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        # Allow running without API key for UI testing
-        return {
-            "intent": "other",
-            "tone": "other",
-            "risk_level": "other",
-            "should_offer_skill": True,
-            "assistant_message": (
-                "API key not set. I can show the chatbot UI, but I can’t generate responses yet.\n\n"
-                "Set OPENAI_API_KEY in your environment or .env file."
-            ),
-        }
-
-    client = OpenAI(api_key=api_key)
+def _chat_bubble_html(role: str, content: str) -> str:
+    # Escape user content to avoid HTML injection and preserve newlines
+    safe = html.escape(content)
+    safe = safe.replace('\n', '<br/>')
+    bubble_class = 'assistant' if role == 'assistant' else 'user'
+    return f'<div class="chat-bubble {bubble_class}">{safe}</div>'
 
-    # Use Chat Completions API with JSON mode
-    # Model provides explicit confidence scores in the JSON response
+class StreamingBubble:
+    """Assistant bubble that replaces the typing indicator on the first streamed text and grows as more arrives"""
     
-    # Build the prompt with schema categories
-    schema_to_send = None
-    if isinstance(COACH_OUTPUT_SCHEMA, dict) and "schema" in COACH_OUTPUT_SCHEMA:
-        schema_to_send = COACH_OUTPUT_SCHEMA["schema"]
-    else:
-        schema_to_send = COACH_OUTPUT_SCHEMA
-    
-    # Extract intent and tone options from schema
-    intent_options = schema_to_send["properties"]["intent"]["enum"]
-    tone_options = schema_to_send["properties"]["tone"]["enum"]
+    def __init__(self, typing_placeholder):
+        self.typing_placeholder = typing_placeholder
+        self.bubble = None
     
-    # Create a prompt that includes the schema structure with explicit confidence scores
-    schema_prompt = f"""You must respond with valid JSON matching this schema:
-{{
-  "intent": one of {intent_options},
-  "tone": one of {tone_options},
-  "intent_confidence": number 0.0-1.0,
-  "tone_confidence": number 0.0-1.0,
-  "risk_level": "low" | "medium" | "high",
-  "should_offer_skill": boolean,
-  "assistant_message": string
-}}
+    def update(self, text: str):
+        if self.bubble is None:
+            self.typing_placeholder.empty()
+            st.markdown("<hr style='border:none;border-top:1px solid #eee;margin:8px 0;'/>", unsafe_allow_html=True)
+            self.bubble = _render_message_with_avatar({"role": "assistant", "content": text})
+        else:
+            self.bubble.markdown(_chat_bubble_html("assistant", text), unsafe_allow_html=True)
 
-CRITICAL - Confidence Scoring:
+# Structured outputs: the API enforces COACH_OUTPUT_SCHEMA (intent/tone enums included), so
+# the prompt only carries guidance the schema cannot express. Both are built once at import.
+COACH_RESPONSE_FORMAT = {"type": "json_schema", "json_schema": COACH_OUTPUT_SCHEMA}
+CONFIDENCE_GUIDANCE = """CRITICAL - Confidence Scoring:
 Provide REALISTIC confidence scores (0.0-1.0) based on classification certainty. DO NOT default to 0.9 or 1.0.
 
 Guidelines:
@@ -1131,59 +1123,77 @@ Guidelines:
 
 Use the FULL range. Don't cluster around 0.9 or round to 1.0 unless truly 100% certain.
 Confidence scores should reflect the model's true certainty about the classifications.
-Confidence scores should be different for both primary emotion and emotional tone based on the input. 
+Confidence scores should be different for both primary emotion and emotional tone based on the input.
 """
+COACH_SYSTEM_PROMPT = SYSTEM_PROMPT + "\n\n" + CONFIDENCE_GUIDANCE
 
-    # Build messages with conversation history
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT + "\n\n" + schema_prompt},
-        {"role": "system", "content": "Coping skill cards (use only these):\n\n" + rag_context},
-    ]
-    
-    # Add conversation history if provided
-    if conversation_history:
-        for msg in conversation_history[:-1]:  # Exclude the current message we're about to add
-            if msg.get("role") in ["user", "assistant"]:
-                messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-    
-    # Add current user message
-    messages.append({"role": "user", "content": user_message})
+def _stream_model_reply(messages: list, on_text) -> str:
+    """Stream the JSON reply, passing the assistant_message decoded so far to on_text; returns the full JSON"""
+    field = JsonStringFieldStream("assistant_message")
+    for delta in stream_chat_completion(messages=messages, response_format=COACH_RESPONSE_FORMAT):
+        if field.feed(delta):
+            on_text(field.value)
+    return field.text
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
-        response_format={"type": "json_object"}
-    )
+def call_model(user_message: str, rag_context: str, conversation_history: list = None, on_text=None,
+               summary: str = "", card_catalog: str = "") -> str:
+    # conversation_history holds the turns sent verbatim (not the current message); summary
+    # covers the turns before them. build_messages orders them for the prompt cache and
+    # trims the list to the token budget.
+    # With on_text the reply is streamed: on_text gets the assistant_message text so far as it
+    # arrives, and intent/tone/confidence are parsed once the stream closes
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        # Allow running without API key for UI testing
+        return {
+            "intent": "other",
+            "tone": "other",
+            "risk_level": "other",
+            "should_offer_skill": True,
+            "assistant_message": (
+                "API key not set. I can show the chatbot UI, but I can’t generate responses yet.\n\n"
+                "Set OPENAI_API_KEY in your environment or .env file."
+            ),
+        }
+
+    messages = build_messages(COACH_SYSTEM_PROMPT, user_message, rag_context, conversation_history,
+                              summary=summary, card_catalog=card_catalog)
 
-    # Parse the response - model provides confidence scores
-    parsed = None
     try:
-        content = response.choices[0].message.content
-        result = json.loads(content)
-        
-        # Use model's confidence scores (already in result)
-        # Set defaults if missing
-        if "intent_confidence" not in result:
-            result["intent_confidence"] = 0.5
-        if "tone_confidence" not in result:
-            result["tone_confidence"] = 0.5
-                
+        if on_text is None:
+            response = chat_completion(
+                messages=messages,
+                response_format=COACH_RESPONSE_FORMAT
+            )
+            choice = response.choices[0]
+            content = choice.message.content
+            if choice.finish_reason != "stop":
+                # Cut off by max tokens or a content filter: the JSON is incomplete
+                print(f"Model reply ended early: {choice.finish_reason}")
+                content = None
+        else:
+            content = _stream_model_reply(messages, on_text)
     except Exception as e:
-        # Fallback if parsing fails
-        result = {
-            "intent": "stress",
-            "tone": "calm",
-            "intent_confidence": 0.5,
-            "tone_confidence": 0.5,
-            "risk_level": "low",
-            "should_offer_skill": True,
-            "assistant_message": "I'm having trouble analyzing that. Can you tell me more?"
-        }
+        print(f"Error calling model: {e}")
+        content = None
     
-    return result
+    # The schema guarantees a complete reply parses; no content means the call failed
+    # or the model refused (a refusal carries no content), and a streamed reply that
+    # was cut off fails to parse
+    if content:
+        try:
+            return json.loads(content)
+        except ValueError as e:
+            print(f"Error parsing model reply: {e}")
+    return {
+        "intent": "stress",
+        "tone": "calm",
+        "intent_confidence": 0.5,
+        "tone_confidence": 0.5,
+        "risk_level": "low",
+        "should_offer_skill": True,
+        "assistant_message": "I'm having trouble with that right now. Can you tell me more?"
+    }
 
 # Only render chat interface when on chat page
 if st.session_state.get("page") == "chat":
@@ -1304,13 +1314,23 @@ if st.session_state.get("page") == "chat":
         )
         
         # Format the combined context for the prompt
-        combined_context = format_combined_context(
+        combined_context = format_turn_context(
             skill_cards=context_data["skill_cards"],
             documents=context_data["documents"]
         )
         
-        # Call model to get structured response with proper intent classification
-        result = call_model(user_text, combined_context, st.session_state["messages"])
+        # Call model to get structured response with proper intent classification,
+        # streaming the reply into its bubble as it arrives
+        # Older turns are covered by a rolling summary stored with the session
+        summary, recent_history = bounded_history(
+            st.session_state.get("user_id"),
+            st.session_state.get("session_id"),
+            st.session_state["messages"][:-1]
+        )
+        streaming_bubble = StreamingBubble(typing_placeholder) if STREAM_REPLIES else None
+        result = call_model(user_text, combined_context, recent_history, summary=summary,
+                            card_catalog=format_card_catalog(cards),
+                            on_text=streaming_bubble.update if streaming_bubble else None)
         
         # Clear typing indicator
         typing_placeholder.empty()
@@ -1355,13 +1375,23 @@ if st.session_state.get("page") == "chat":
                 content=bot_text
             )
             
-            # Divider if previous role was different
-            if len(st.session_state["messages"]) >= 2:
-                prev = st.session_state["messages"][-2]
-                if prev.get("role") != "assistant":
-                    st.markdown("<hr style='border:none;border-top:1px solid #eee;margin:8px 0;'/>", unsafe_allow_html=True)
-            _render_message_with_avatar({"role": "assistant", "content": bot_text})
+            if streaming_bubble is not None and streaming_bubble.bubble is not None:
+                # Already on screen; show the final text in case parsing fell back
+                streaming_bubble.update(bot_text)
+            else:
+                # Divider if previous role was different
+                if len(st.session_state["messages"]) >= 2:
+                    prev = st.session_state["messages"][-2]
+                    if prev.get("role") != "assistant":
+                        st.markdown("<hr style='border:none;border-top:1px solid #eee;margin:8px 0;'/>", unsafe_allow_html=True)
+                _render_message_with_avatar({"role": "assistant", "content": bot_text})
 
+            # The reply is on screen; fold older turns into the summary for the next turn
+            start_folding(
+                st.session_state.get("user_id"),
+                st.session_state.get("session_id"),
+                st.session_state["messages"]
+            )
         
       
         # Log structured fields (NO raw user text stored)
@@ -1374,6 +1404,8 @@ if st.session_state.get("page") == "chat":
             "tone_confidence": result.get("tone_confidence", 0.0),
             "risk_level": result["risk_level"],
             "should_offer_skill": result["should_offer_skill"],
+            # Prompt and cached token counts of this turn's model call
+            "usage": usage_report()["last"],
         })
 
 # Footer for chat page
@@ -0,0 +1,238 @@
+"""
+Benchmark retrieval on synthetic teen-topic corpora at several scales.
+
+    python benchmark_rag.py --scales 10,1000,10000 --output benchmark_results.json
+    python benchmark_rag.py --baseline benchmark_results.json --output benchmark_new.json   # exit 1 on a p95 regression
+
+Each scale runs in a fresh process so its peak RSS is its own. Results are written as JSON.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+import rag
+
+# Words per teen topic; documents mix one or two topics with filler
+TOPIC_WORDS = {
+    "exams": "exam test study grades finals homework deadline teacher revision quiz score school class".split(),
+    "sleep": "sleep tired insomnia bedtime rest nap exhausted night phone screen awake dreams".split(),
+    "friends": "friends friendship group chat party invite left out trust gossip best friend".split(),
+    "family": "parents family mom dad siblings argue rules home divorce chores curfew".split(),
+    "social_media": "instagram tiktok likes followers scrolling posts comments online compare feed".split(),
+    "anxiety": "anxiety worried nervous panic heart racing breathing overthinking fear calm".split(),
+    "mood": "sad lonely down crying empty numb angry frustrated upset hopeless".split(),
+    "body": "body image weight appearance mirror eating exercise sports confidence".split(),
+    "bullying": "bullying teased mean rumors excluded harassment hurtful threats report".split(),
+    "coping": "coping grounding journaling walk music talk counselor support breathe routine".split(),
+}
+FILLER_WORDS = (
+    "the a to and of it is that you feel can when with this for sometimes often really "
+    "many teens might try help notice time day week about more like just know think"
+).split()
+QUERY_TEMPLATES = [
+    "i can't stop thinking about {0} and {1}",
+    "how do i deal with {0}",
+    "feeling {0} because of {1}",
+    "my {0} is making me {1}",
+    "{0} {1} {2}",
+    "what helps with {0} when {1}",
+]
+
+def generate_corpus(n_documents: int, out_dir: Path, seed: int = 0) -> None:
+    """Write n_documents synthetic .txt documents of 3-8 topical paragraphs"""
+    rng = random.Random(seed)
+    topics = list(TOPIC_WORDS)
+    for n in range(n_documents):
+        main, side = rng.sample(topics, 2)
+        paragraphs = []
+        for _ in range(rng.randint(3, 8)):
+            words = []
+            for _ in range(rng.randint(40, 90)):
+                roll = rng.random()
+                pool = TOPIC_WORDS[main] if roll < 0.45 else TOPIC_WORDS[side] if roll < 0.6 else FILLER_WORDS
+                words.append(rng.choice(pool))
+            paragraphs.append(" ".join(words).capitalize() + ".")
+        (out_dir / f"{main}_{n:06d}.txt").write_text("\n\n".join(paragraphs), encoding="utf-8")
+
+def generate_queries(n_queries: int, seed: int = 1) -> List[Tuple[str, Optional[str]]]:
+    """Build (query, intent) pairs from topic words; about half carry an intent"""
+    rng = random.Random(seed)
+    words = [word for topic in TOPIC_WORDS.values() for word in topic]
+    intents = list(rag.INTENT_KEYWORDS)
+    queries = []
+    for _ in range(n_queries):
+        query = rng.choice(QUERY_TEMPLATES).format(*rng.sample(words, 3))
+        queries.append((query, rng.choice(intents) if rng.random() < 0.5 else None))
+    return queries
+
+def _latency_stats(latencies: List[float]) -> Dict[str, float]:
+    """Percentiles in milliseconds and throughput from per-call seconds"""
+    values = np.asarray(latencies) * 1000
+    return {
+        "calls": len(latencies),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "throughput_qps": round(len(latencies) / max(float(np.sum(latencies)), 1e-9), 1),
+    }
+
+def _measure(call, queries: List[Tuple[str, Optional[str]]], memory_queries: int,
+             warm: bool = False) -> Dict[str, Any]:
+    """Time call(query, intent) per query, then trace peak allocations over a short pass"""
+    if warm:
+        for query, intent in queries:
+            call(query, intent)
+    latencies = []
+    for query, intent in queries:
+        start = time.perf_counter()
+        call(query, intent)
+        latencies.append(time.perf_counter() - start)
+    stats = _latency_stats(latencies)
+
+    # Tracing slows every allocation, so memory gets its own pass
+    tracemalloc.start()
+    for query, intent in queries[:memory_queries]:
+        call(query, intent)
+    stats["peak_alloc_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+    tracemalloc.stop()
+    return stats
+
+def run_scale(n_documents: int, n_queries: int, memory_queries: int, streaming: bool) -> Dict[str, Any]:
+    """Build an index over a synthetic corpus and benchmark every retrieval mode on it"""
+    queries = generate_queries(n_queries)
+    with tempfile.TemporaryDirectory(prefix="rag_bench_") as tmp:
+        generate_corpus(n_documents, Path(tmp))
+        start = time.perf_counter()
+        snapshot = rag.build_index_from_directory(tmp, streaming=streaming)
+        build_seconds = time.perf_counter() - start
+
+    rag.set_index(snapshot)
+    cards = rag.load_cards(str(Path(__file__).resolve().parent / rag.CARDS_PATH))
+    memory = rag.memory_report()
+    result = {
+        "documents": n_documents,
+        "chunks": len(snapshot.chunks),
+        "streaming": streaming,
+        "build_seconds": round(build_seconds, 3),
+        "index_heap_mb": round(memory["total_heap"] / 2 ** 20, 2),
+        "index_mapped_mb": round(sum(memory["memory_mapped"].values()) / 2 ** 20, 2),
+        "modes": {},
+    }
+
+    # Without the SVD (RAG_LSA unset) "lsa" would only time the TF-IDF fallback again
+    rankers = [ranker for ranker in rag.RANKERS if ranker != "lsa" or snapshot.lsa_components is not None]
+    modes = {}
+    for ranker in rankers:
+        modes[f"search_documents[{ranker}]"] = (
+            lambda query, intent, ranker=ranker: rag.search_documents(query, intent=intent, k=2, ranker=ranker)
+        )
+    modes["retrieve_cards"] = lambda query, intent: rag.retrieve_cards(cards, intent or "stress", k=4)
+
+    def combined(query, intent):
+        rag.clear_context_cache()
+        return rag.retrieve_combined_context(cards, query, intent or "", k_cards=4, k_docs=2)
+    modes["retrieve_combined_context"] = combined
+    modes["retrieve_combined_context[cached]"] = (
+        lambda query, intent: rag.retrieve_combined_context(cards, query, intent or "", k_cards=4, k_docs=2)
+    )
+
+    for name, call in modes.items():
+        result["modes"][name] = _measure(call, queries, memory_queries, warm=name.endswith("[cached]"))
+
+    # Batch search amortizes query vectorization; time it as one call per batch of 32
+    for ranker in rankers:
+        latencies = []
+        for i in range(0, len(queries), 32):
+            batch = queries[i:i + 32]
+            start = time.perf_counter()
+            rag.search_documents_batch([q for q, _ in batch], [intent for _, intent in batch], k=2, ranker=ranker)
+            latencies.append((time.perf_counter() - start) / len(batch))
+        stats = _latency_stats(latencies)
+        stats["calls"] = len(queries)
+        result["modes"][f"search_documents_batch[{ranker}]"] = stats
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss_mb"] = round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+    return result
+
+def compare_to_baseline(results: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> List[str]:
+    """List modes whose p95 latency regressed more than tolerance against a previous run"""
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))
+    previous = {entry["documents"]: entry for entry in baseline["results"]}
+    regressions = []
+    for entry in results:
+        old = previous.get(entry["documents"])
+        if old is None:
+            continue
+        for mode, stats in entry["modes"].items():
+            old_stats = old["modes"].get(mode)
+            if old_stats and stats["p95_ms"] > old_stats["p95_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{entry['documents']} docs {mode}: p95 {old_stats['p95_ms']} -> {stats['p95_ms']} ms"
+                )
+    return regressions
+
+def main():
+    """Run each scale in its own process, print a summary and write JSON results"""
+    parser = argparse.ArgumentParser(description="Benchmark rag.py retrieval on synthetic corpora")
+    parser.add_argument("--scales", default="10,1000,10000",
+                        help="comma-separated document counts (100000 works best with --streaming)")
+    parser.add_argument("--queries", type=int, default=300, help="queries timed per mode")
+    parser.add_argument("--memory-queries", type=int, default=30, help="queries traced for peak allocations")
+    parser.add_argument("--streaming", action="store_true", help="use the streaming hashed-feature build")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write JSON results")
+    parser.add_argument("--baseline", help="previous results (not the --output file); exit 1 if any p95 regressed")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown vs baseline")
+    args = parser.parse_args()
+    if args.baseline and Path(args.baseline).resolve() == Path(args.output).resolve():
+        # The run would overwrite its own baseline and then compare against itself
+        parser.error("--output must differ from --baseline")
+
+    results = []
+    for n_documents in [int(scale) for scale in args.scales.split(",")]:
+        print(f"Benchmarking {n_documents} documents...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            result = pool.submit(run_scale, n_documents, args.queries, args.memory_queries, args.streaming).result()
+        results.append(result)
+        print(f"  build {result['build_seconds']}s, {result['chunks']} chunks, "
+              f"heap {result['index_heap_mb']} MB, peak RSS {result['peak_rss_mb']} MB")
+        for mode, stats in result["modes"].items():
+            print(f"  {mode:40s} p50 {stats['p50_ms']:8.3f}  p95 {stats['p95_ms']:8.3f}  "
+                  f"p99 {stats['p99_ms']:8.3f} ms  {stats['throughput_qps']:9.1f} q/s")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "queries": args.queries,
+            "default_ranker": rag.DEFAULT_RANKER,
+            "lsa": rag.LSA_ENABLED,
+        },
+        "results": results,
+    }
+    regressions = compare_to_baseline(results, args.baseline, args.tolerance) if args.baseline else []
+    Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Wrote {args.output}")
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
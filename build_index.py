@@ -0,0 +1,34 @@
+"""
+Build the versioned retrieval artifact offline, so the app never parses source documents.
+
+    python build_index.py --out data/rag_artifact
+    RAG_ARTIFACT=data/rag_artifact streamlit run app.py
+"""
+import argparse
+import sys
+from rag import build_artifact, DATA_DIR, CARDS_PATH
+
+def main():
+    """Build the artifact and print a summary of its manifest"""
+    parser = argparse.ArgumentParser(description="Build the retrieval artifact loaded by the app")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="directory of source documents")
+    parser.add_argument("--cards", default=CARDS_PATH, help="skill cards JSON file")
+    parser.add_argument("--out", default="data/rag_artifact", help="artifact directory to (re)write")
+    parser.add_argument("--streaming", action="store_true",
+                        help="hashed-feature build that reads one document at a time (for large corpora)")
+    args = parser.parse_args()
+    
+    try:
+        manifest = build_artifact(args.out, data_dir=args.data_dir, cards_path=args.cards,
+                                  streaming=args.streaming or None)
+    except Exception as e:
+        print(f"Error building artifact: {e}")
+        sys.exit(1)
+    
+    print(f"Wrote artifact {manifest['version']} to {args.out}")
+    print(f"  sources: {len(manifest['sources'])} documents")
+    for name, digest in manifest["files"].items():
+        print(f"  {name}  {digest[:12]}")
+
+if __name__ == "__main__":
+    main()
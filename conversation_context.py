@@ -0,0 +1,154 @@
+"""Bounded conversation context for call_model: recent turns verbatim, older turns as a rolling summary"""
+from __future__ import annotations
+import os
+import threading
+from typing import List, Dict, Optional, Tuple
+
+from db_utils import load_session_summary, save_session_summary
+from llm_gateway import chat_completion
+
+# Turns (user + assistant message pairs) always sent verbatim
+RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "6"))
+# Older messages are folded into the summary in batches of this many turns, so the
+# summarizer runs every few turns instead of on every one (in the background, after the reply)
+SUMMARY_BATCH_TURNS = int(os.getenv("CONTEXT_SUMMARY_BATCH_TURNS", "3"))
+SUMMARY_MAX_TOKENS = 250
+# Estimated tokens allowed for the whole message list sent to the model
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Sessions with a summary fold in flight, so a fast second turn does not start another
+_folding = set()
+_folding_lock = threading.Lock()
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a teen and Juno, a coping-skills coach.
+Update the summary with the new messages. Keep what matters for supporting them later: what is going on,
+how they feel, stressors, coping skills suggested or tried and what helped. Write at most 120 words in
+plain sentences, in the third person ("they"), with no names or identifying details."""
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def message_tokens(messages: List[Dict[str, str]]) -> int:
+    """Estimated prompt tokens of a message list"""
+    return sum(estimate_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS for msg in messages)
+
+def summarize_turns(previous_summary: str, messages: List[Dict[str, str]]) -> Optional[str]:
+    """Fold messages into the previous summary; None if the model call fails"""
+    transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+    try:
+        response = chat_completion(
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"Summary so far:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"}
+            ],
+            temperature=0.2,
+            max_tokens=SUMMARY_MAX_TOKENS
+        )
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"Error summarizing conversation: {e}")
+        return None
+
+def _stored_summary(user_id: int, session_id: str, history: List[Dict[str, str]]) -> Tuple[str, int]:
+    """The session's summary and how many leading history messages it covers"""
+    stored = load_session_summary(user_id, session_id) if user_id is not None else None
+    summary, summarized = (stored["summary"], stored["summarized_messages"]) if stored else ("", 0)
+    if summarized > len(history):
+        # The on-screen chat was reset; its old summary no longer applies
+        summary, summarized = "", 0
+        save_session_summary(user_id, session_id, summary, summarized)
+    return summary, summarized
+
+def bounded_history(user_id: int, session_id: str,
+                    history: List[Dict[str, str]]) -> Tuple[str, List[Dict[str, str]]]:
+    """Split a session's history (excluding the current message) into (summary, verbatim messages).
+
+    The summary and how many leading messages it covers are stored with the session, so
+    each message is summarized once. Never calls the model: summaries are folded by
+    start_folding after a reply, and messages past the stored summary are sent verbatim.
+    """
+    history = [msg for msg in history if msg.get("role") in ("user", "assistant")]
+    summary, summarized = _stored_summary(user_id, session_id, history)
+    return summary, history[summarized:]
+
+def fold_older_turns(user_id: int, session_id: str, history: List[Dict[str, str]]) -> bool:
+    """Fold older turns into the stored summary; True if the summary changed.
+
+    Runs once SUMMARY_BATCH_TURNS turns beyond the last RECENT_TURNS have built up, and
+    folds everything but those recent turns.
+    """
+    history = [msg for msg in history if msg.get("role") in ("user", "assistant")]
+    summary, summarized = _stored_summary(user_id, session_id, history)
+    keep = RECENT_TURNS * 2
+    if len(history) - summarized <= keep + SUMMARY_BATCH_TURNS * 2:
+        return False
+    folded = summarize_turns(summary, history[summarized:len(history) - keep])
+    if folded is None:
+        return False
+    save_session_summary(user_id, session_id, folded, len(history) - keep)
+    return True
+
+def start_folding(user_id: int, session_id: str, history: List[Dict[str, str]]) -> None:
+    """Run fold_older_turns on a background thread, so the summarizer never delays a reply.
+
+    Call it after the reply is shown; the next turn picks up the new summary. Sessions of
+    signed-out users have nowhere to store one and rely on the token budget alone.
+    """
+    if user_id is None or not session_id:
+        return
+    with _folding_lock:
+        if session_id in _folding:
+            return
+        _folding.add(session_id)
+    
+    def fold():
+        try:
+            fold_older_turns(user_id, session_id, history)
+        except Exception as e:
+            print(f"Error folding conversation summary: {e}")
+        finally:
+            with _folding_lock:
+                _folding.discard(session_id)
+    
+    # A copy, since the session's message list keeps growing on the next turn
+    history = list(history)
+    threading.Thread(target=fold, name=f"summary-{session_id}", daemon=True).start()
+
+def fit_to_token_budget(messages: List[Dict[str, str]], budget: int = CONTEXT_TOKEN_BUDGET) -> List[Dict[str, str]]:
+    """Drop the oldest history messages until the list fits the budget.
+
+    System messages and the final (current) message are always kept.
+    """
+    messages = list(messages)
+    total = message_tokens(messages)
+    i = 0
+    while total > budget and i < len(messages) - 1:
+        if messages[i]["role"] == "system":
+            i += 1
+            continue
+        total -= message_tokens([messages.pop(i)])
+    return messages
+
+def build_messages(system_prompt: str, user_message: str, rag_context: str = "",
+                   history: Optional[List[Dict[str, str]]] = None, summary: str = "",
+                   card_catalog: str = "") -> List[Dict[str, str]]:
+    """The message list for one turn, trimmed to the token budget.
+
+    Messages run from most to least stable so the provider can cache the longest prefix:
+    the system prompt and full card catalog (identical for every turn and user), the
+    summary, the history (which only grows), then this turn's retrieval context.
+    """
+    messages = [{"role": "system", "content": system_prompt + "\n\n" + card_catalog if card_catalog else system_prompt}]
+    if summary:
+        messages.append({"role": "system", "content": "Summary of the earlier conversation:\n" + summary})
+    for msg in history or []:
+        if msg.get("role") in ("user", "assistant"):
+            messages.append({"role": msg["role"], "content": msg["content"]})
+    # Retrieval context for this message goes last, just before the message itself
+    if rag_context:
+        messages.append({"role": "system", "content": "Context for this message:\n\n" + rag_context})
+    messages.append({"role": "user", "content": user_message})
+    return fit_to_token_budget(messages, CONTEXT_TOKEN_BUDGET)
@@ -1,5 +1,6 @@
 """Database models and setup for Juno Teen Coach"""
 from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Float
+from sqlalchemy import text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -26,6 +27,7 @@ class User(Base):
     # Relationships
     chat_sessions = relationship("ChatSession", back_populates="user", cascade="all, delete-orphan")
     journal_entries = relationship("JournalEntry", back_populates="user", cascade="all, delete-orphan")
+    session_summaries = relationship("SessionSummary", back_populates="user", cascade="all, delete-orphan")
 
 class ChatSession(Base):
     """Chat session/message model"""
@@ -59,9 +61,83 @@ class JournalEntry(Base):
     # Relationship
     user = relationship("User", back_populates="journal_entries")
 
+class SessionSummary(Base):
+    """Rolling summary of the older turns of a chat session"""
+    __tablename__ = "session_summaries"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    session_id = Column(String(100), unique=True, nullable=False, index=True)
+    summary = Column(Text, nullable=False)
+    summarized_messages = Column(Integer, nullable=False)  # Leading history messages folded into the summary
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationship
+    user = relationship("User", back_populates="session_summaries")
+
+class CorpusDocument(Base):
+    """Source document ingested into the retrieval corpus"""
+    __tablename__ = "corpus_documents"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    path = Column(String(500), unique=True, nullable=False, index=True)
+    title = Column(String(255), nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    size = Column(Integer, nullable=False)
+    mtime_ns = Column(Integer, nullable=False)
+    ingested_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationship
+    chunks = relationship("CorpusChunk", back_populates="document", cascade="all, delete-orphan")
+
+class CorpusChunk(Base):
+    """Paragraph-window chunk of a corpus document"""
+    __tablename__ = "corpus_chunks"
+    # Ids are never reused, so an index that has not caught up yet cannot show another chunk's text
+    __table_args__ = {"sqlite_autoincrement": True}
+    
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("corpus_documents.id"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)  # Order within the document
+    text = Column(Text, nullable=False)
+    
+    # Relationship
+    document = relationship("CorpusDocument", back_populates="chunks")
+
+class CorpusState(Base):
+    """Single-row counter bumped by every corpus change, so workers can tell their index is stale"""
+    __tablename__ = "corpus_state"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# FTS5 shadow index over corpus_chunks.text (SQLite only), kept in sync by triggers
+CORPUS_FTS_STATEMENTS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS corpus_chunks_fts USING fts5(
+        text, content='corpus_chunks', content_rowid='id', tokenize='porter unicode61')""",
+    """CREATE TRIGGER IF NOT EXISTS corpus_chunks_ai AFTER INSERT ON corpus_chunks BEGIN
+        INSERT INTO corpus_chunks_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS corpus_chunks_ad AFTER DELETE ON corpus_chunks BEGIN
+        INSERT INTO corpus_chunks_fts(corpus_chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS corpus_chunks_au AFTER UPDATE ON corpus_chunks BEGIN
+        INSERT INTO corpus_chunks_fts(corpus_chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO corpus_chunks_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+]
+
 def init_db():
     """Initialize the database - create all tables"""
     Base.metadata.create_all(bind=engine)
+    if engine.dialect.name == "sqlite":
+        try:
+            with engine.begin() as conn:
+                for statement in CORPUS_FTS_STATEMENTS:
+                    conn.execute(text(statement))
+        except Exception as e:
+            print(f"Error creating corpus full-text index: {e}")
 
 def get_db():
     """Get database session"""
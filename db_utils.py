@@ -1,6 +1,8 @@
-"""Database utility functions for chat and journal operations"""
-from database import ChatSession, JournalEntry, get_db
+"""Database utility functions for chat, journal, session summary and retrieval corpus operations"""
+from database import ChatSession, JournalEntry, SessionSummary, CorpusDocument, CorpusChunk, CorpusState, get_db
 from datetime import datetime
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from sqlalchemy import text
 
 def save_chat_message(user_id: int, session_id: str, role: str, content: str, 
                      intent: str = None, tone: str = None,
@@ -159,3 +161,170 @@ def load_journal_entries(user_id: int):
         ]
     finally:
         db.close()
+
+def load_session_summary(user_id: int, session_id: str) -> Optional[Dict[str, Any]]:
+    """Load the rolling summary of a chat session's older turns"""
+    db = get_db()
+    try:
+        row = db.query(SessionSummary).filter(
+            SessionSummary.user_id == user_id,
+            SessionSummary.session_id == session_id
+        ).first()
+        if row is None:
+            return None
+        return {"summary": row.summary, "summarized_messages": row.summarized_messages}
+    finally:
+        db.close()
+
+def save_session_summary(user_id: int, session_id: str, summary: str, summarized_messages: int):
+    """Insert or update the rolling summary of a chat session"""
+    db = get_db()
+    try:
+        row = db.query(SessionSummary).filter(SessionSummary.session_id == session_id).first()
+        if row is None:
+            row = SessionSummary(user_id=user_id, session_id=session_id)
+            db.add(row)
+        row.summary = summary
+        row.summarized_messages = summarized_messages
+        row.updated_at = datetime.utcnow()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error saving session summary: {e}")
+    finally:
+        db.close()
+
+def load_corpus_documents() -> List[Dict[str, Any]]:
+    """Load every corpus document's metadata and source fingerprint, in ingestion order"""
+    db = get_db()
+    try:
+        documents = db.query(CorpusDocument).order_by(CorpusDocument.id).all()
+        return [
+            {
+                "id": doc.id,
+                "path": doc.path,
+                "title": doc.title,
+                "sha256": doc.sha256,
+                "size": doc.size,
+                "mtime_ns": doc.mtime_ns
+            }
+            for doc in documents
+        ]
+    finally:
+        db.close()
+
+def _bump_corpus_version(db) -> None:
+    """Count one corpus change inside the caller's transaction"""
+    updated = db.query(CorpusState).filter(CorpusState.id == 1).update(
+        {CorpusState.version: CorpusState.version + 1}, synchronize_session=False
+    )
+    if not updated:
+        db.add(CorpusState(id=1, version=1))
+
+def get_corpus_version() -> int:
+    """Number of corpus changes committed so far (0 for an empty store)"""
+    db = get_db()
+    try:
+        state = db.get(CorpusState, 1)
+        return state.version if state is not None else 0
+    finally:
+        db.close()
+
+def save_corpus_document(path: str, title: str, fingerprint: Dict[str, Any], chunks: List[str]) -> Optional[int]:
+    """Insert or replace a corpus document and its chunks in one transaction; returns its id"""
+    db = get_db()
+    try:
+        doc = db.query(CorpusDocument).filter(CorpusDocument.path == path).first()
+        if doc is None:
+            doc = CorpusDocument(path=path)
+            db.add(doc)
+        else:
+            db.query(CorpusChunk).filter(CorpusChunk.document_id == doc.id).delete(synchronize_session=False)
+        doc.title = title
+        doc.sha256 = fingerprint["sha256"]
+        doc.size = fingerprint["size"]
+        doc.mtime_ns = fingerprint["mtime_ns"]
+        doc.ingested_at = datetime.utcnow()
+        db.flush()
+        db.add_all(CorpusChunk(document_id=doc.id, position=i, text=chunk) for i, chunk in enumerate(chunks))
+        _bump_corpus_version(db)
+        db.commit()
+        return doc.id
+    except Exception as e:
+        db.rollback()
+        print(f"Error saving corpus document {path}: {e}")
+        return None
+    finally:
+        db.close()
+
+def delete_corpus_document(path: str) -> bool:
+    """Delete a corpus document and its chunks"""
+    db = get_db()
+    try:
+        doc = db.query(CorpusDocument).filter(CorpusDocument.path == path).first()
+        if doc is None:
+            return False
+        db.query(CorpusChunk).filter(CorpusChunk.document_id == doc.id).delete(synchronize_session=False)
+        db.delete(doc)
+        _bump_corpus_version(db)
+        db.commit()
+        return True
+    except Exception as e:
+        db.rollback()
+        print(f"Error deleting corpus document {path}: {e}")
+        return False
+    finally:
+        db.close()
+
+def iter_corpus_chunks(batch_size: int = 1000) -> Iterator[Tuple[int, int, str]]:
+    """Stream (chunk id, document id, text) for every corpus chunk in id order"""
+    db = get_db()
+    try:
+        rows = db.query(CorpusChunk.id, CorpusChunk.document_id, CorpusChunk.text).order_by(CorpusChunk.id)
+        for chunk_id, document_id, chunk_text in rows.yield_per(batch_size):
+            yield chunk_id, document_id, chunk_text
+    finally:
+        db.close()
+
+def load_corpus_chunks(document_id: int) -> List[Tuple[int, str]]:
+    """(chunk id, text) of one corpus document's chunks in order"""
+    db = get_db()
+    try:
+        rows = db.query(CorpusChunk.id, CorpusChunk.text).filter(
+            CorpusChunk.document_id == document_id
+        ).order_by(CorpusChunk.position).all()
+        return [(chunk_id, chunk_text) for chunk_id, chunk_text in rows]
+    finally:
+        db.close()
+
+def get_corpus_chunk_texts(chunk_ids: List[int]) -> Dict[int, str]:
+    """Fetch chunk text by id; ids that no longer exist are left out"""
+    if not chunk_ids:
+        return {}
+    db = get_db()
+    try:
+        rows = db.query(CorpusChunk.id, CorpusChunk.text).filter(CorpusChunk.id.in_(chunk_ids)).all()
+        return {chunk_id: chunk_text for chunk_id, chunk_text in rows}
+    finally:
+        db.close()
+
+def search_corpus_chunks(match: str, limit: int = 200) -> List[Tuple[int, float]]:
+    """Full-text search over corpus chunks; returns (chunk id, FTS5 bm25 score) best first.
+
+    FTS5 bm25() is negative with lower meaning better, so scores are negated here.
+    """
+    db = get_db()
+    try:
+        rows = db.execute(
+            text(
+                "SELECT rowid, bm25(corpus_chunks_fts) AS rank FROM corpus_chunks_fts "
+                "WHERE corpus_chunks_fts MATCH :match ORDER BY rank LIMIT :limit"
+            ),
+            {"match": match, "limit": limit}
+        ).all()
+        return [(chunk_id, -rank) for chunk_id, rank in rows]
+    except Exception as e:
+        print(f"Error searching corpus chunks: {e}")
+        return []
+    finally:
+        db.close()
@@ -0,0 +1,196 @@
+"""
+Evaluate retrieval quality against latency and index size over a grid of configurations.
+
+    python evaluate_rag.py --labels data/eval_queries.json --recall-bar 0.8
+
+The labels file is a JSON list (or JSONL) of queries with the documents that should come back;
+documents are named by title (file stem), file name or path:
+
+    [{"query": "I can't sleep before exams", "intent": "test_anxiety", "relevant": ["sleep_hygiene"]}]
+
+Every (ranker, max_features, ngram_range, min_similarity, k) combination is scored with
+recall@k and MRR@k next to p50/p95 latency and index size, then the fastest configuration
+meeting the quality bar is recommended.
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+import rag
+
+MAX_FEATURES_GRID = [500, 1000, 5000, None]
+NGRAM_RANGE_GRID = [(1, 1), (1, 2)]
+K_GRID = [1, 2, 3, 5]
+# Score scales differ per ranker, so each has its own thresholds (defaults included)
+MIN_SIMILARITY_GRID = {
+    "tfidf": [0.0, rag.MIN_SIMILARITY, 0.06, 0.1],
+    "lsa": [0.0, 0.1, rag.LSA_MIN_SIMILARITY, 0.3],
+    "bm25": [0.0],
+}
+
+def load_labels(path: str) -> List[Dict[str, Any]]:
+    """Read labeled queries from a JSON list or a JSONL file"""
+    text = Path(path).read_text(encoding="utf-8").strip()
+    labels = json.loads(text) if text.startswith("[") else [json.loads(line) for line in text.splitlines() if line.strip()]
+    for label in labels:
+        if not label.get("query") or not label.get("relevant"):
+            raise ValueError(f"Each label needs a query and a non-empty relevant list: {label}")
+    return labels
+
+def _document_names(doc: Dict[str, Any]) -> set:
+    """Every name a label may use for a document"""
+    path = Path(doc.get("path", ""))
+    return {doc.get("title", ""), path.name, str(path)}
+
+def score_results(results: List[List[Dict[str, Any]]], labels: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Mean recall@k and MRR@k over queries, for results already cut at k"""
+    recalls, reciprocal_ranks = [], []
+    for docs, label in zip(results, labels):
+        relevant = set(label["relevant"])
+        found = set()
+        first_rank = None
+        for rank, doc in enumerate(docs, start=1):
+            hits = _document_names(doc) & relevant
+            if hits:
+                found |= hits
+                first_rank = first_rank or rank
+        recalls.append(len(found) / len(relevant))
+        reciprocal_ranks.append(1.0 / first_rank if first_rank else 0.0)
+    return {"recall": round(float(np.mean(recalls)), 4), "mrr": round(float(np.mean(reciprocal_ranks)), 4)}
+
+def evaluate_config(snapshot: rag.IndexSnapshot, labels: List[Dict[str, Any]], ranker: str,
+                    min_similarity: float, k: int) -> Dict[str, Any]:
+    """Run every labeled query one at a time, as the app does, and score the results"""
+    results, latencies = [], []
+    for label in labels:
+        start = time.perf_counter()
+        docs = rag.search_documents_batch([label["query"]], [label.get("intent")], k=k, ranker=ranker,
+                                          snapshot=snapshot, min_similarity=min_similarity)[0]
+        latencies.append(time.perf_counter() - start)
+        results.append(docs)
+    values = np.asarray(latencies) * 1000
+    return {
+        **score_results(results, labels),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+    }
+
+# Snapshot structures each ranker searches; every ranker also needs the documents and chunks
+# it returns, and "chunking" is part of every ranker's build
+RANKER_STRUCTURES = {
+    "tfidf": ["vectorizer", "tfidf_matrix", "intent_vectors"],
+    "lsa": ["vectorizer", "intent_vectors", "lsa_components", "lsa_vectors"],
+    "bm25": ["bm25"],
+}
+SHARED_STRUCTURES = ["documents", "chunks"]
+# Build steps behind each ranker (LSA is fitted on the TF-IDF matrix)
+RANKER_BUILD_STEPS = {
+    "tfidf": ["chunking", "tfidf", "intent"],
+    "lsa": ["chunking", "tfidf", "intent", "lsa"],
+    "bm25": ["chunking", "bm25"],
+}
+
+def _ranker_index_mb(snapshot: rag.IndexSnapshot) -> Dict[str, float]:
+    """Heap plus memory-mapped size of the structures each ranker searches"""
+    report = rag.memory_report(snapshot)
+    sizes = {}
+    for ranker, parts in RANKER_STRUCTURES.items():
+        names = SHARED_STRUCTURES + parts
+        total = sum(report["heap"].get(name, 0) + report["memory_mapped"].get(name, 0) for name in names)
+        sizes[ranker] = round(total / 2 ** 20, 2)
+    return sizes
+
+def _ranker_build_seconds(timings: Dict[str, float]) -> Dict[str, float]:
+    """Seconds spent building the structures behind each ranker"""
+    return {ranker: round(sum(timings.get(step, 0.0) for step in steps), 3)
+            for ranker, steps in RANKER_BUILD_STEPS.items()}
+
+def run_grid(documents: List[Dict[str, Any]], labels: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Build one index per vectorizer setting and evaluate every ranker/threshold/k on it"""
+    rows = []
+    for max_features, ngram_range in itertools.product(MAX_FEATURES_GRID, NGRAM_RANGE_GRID):
+        params = {**rag.VECTORIZER_PARAMS, "max_features": max_features, "ngram_range": ngram_range}
+        timings = {}
+        snapshot = rag.build_index_snapshot(documents, vectorizer_params=params, timings=timings, lsa=True)
+        build_seconds = _ranker_build_seconds(timings)
+        index_mb = _ranker_index_mb(snapshot)
+        print(f"max_features={max_features} ngram_range={ngram_range}: "
+              + ", ".join(f"{ranker} built in {build_seconds[ranker]}s, {index_mb[ranker]} MB" for ranker in rag.RANKERS))
+
+        for ranker in rag.RANKERS:
+            # BM25 keeps its own vocabulary, so it is evaluated once rather than per vectorizer setting
+            if ranker == "bm25" and (max_features, ngram_range) != (MAX_FEATURES_GRID[0], NGRAM_RANGE_GRID[0]):
+                continue
+            for min_similarity, k in itertools.product(MIN_SIMILARITY_GRID[ranker], K_GRID):
+                rows.append({
+                    "ranker": ranker,
+                    "max_features": max_features if ranker != "bm25" else None,
+                    "ngram_range": list(ngram_range) if ranker != "bm25" else None,
+                    "min_similarity": min_similarity,
+                    "k": k,
+                    "build_seconds": build_seconds[ranker],
+                    "index_mb": index_mb[ranker],
+                    **evaluate_config(snapshot, labels, ranker, min_similarity, k),
+                })
+    return rows
+
+def pick_fastest(rows: List[Dict[str, Any]], recall_bar: float, mrr_bar: float) -> Optional[Dict[str, Any]]:
+    """The lowest-p95 configuration meeting both quality bars (smaller index breaks ties)"""
+    passing = [row for row in rows if row["recall"] >= recall_bar and row["mrr"] >= mrr_bar]
+    return min(passing, key=lambda row: (row["p95_ms"], row["index_mb"]), default=None)
+
+def main():
+    """Evaluate the configuration grid, print a ranked table and write JSON results"""
+    parser = argparse.ArgumentParser(description="Retrieval quality vs latency evaluation for rag.py")
+    parser.add_argument("--labels", required=True, help="labeled queries (JSON list or JSONL)")
+    parser.add_argument("--data-dir", default=rag.DATA_DIR, help="directory of source documents")
+    parser.add_argument("--recall-bar", type=float, default=0.8, help="minimum recall@k")
+    parser.add_argument("--mrr-bar", type=float, default=0.0, help="minimum MRR@k")
+    parser.add_argument("--output", default="evaluation_results.json", help="where to write JSON results")
+    args = parser.parse_args()
+
+    try:
+        labels = load_labels(args.labels)
+        documents = rag.read_source_documents(args.data_dir)
+    except Exception as e:
+        print(f"Error loading evaluation inputs: {e}")
+        sys.exit(1)
+    if not documents:
+        print(f"No documents found in {args.data_dir}")
+        sys.exit(1)
+    print(f"Evaluating {len(labels)} labeled queries over {len(documents)} documents")
+
+    rows = run_grid(documents, labels)
+    rows.sort(key=lambda row: (-row["recall"], -row["mrr"], row["p95_ms"]))
+    print(f"\n{'ranker':6s} {'max_feat':>8s} {'ngram':>6s} {'min_sim':>7s} {'k':>2s} "
+          f"{'recall':>6s} {'mrr':>6s} {'p50 ms':>7s} {'p95 ms':>7s} {'index MB':>8s}")
+    for row in rows:
+        ngram = "-" if row["ngram_range"] is None else f"{row['ngram_range'][0]},{row['ngram_range'][1]}"
+        print(f"{row['ranker']:6s} {str(row['max_features']):>8s} {ngram:>6s} {row['min_similarity']:7.3f} "
+              f"{row['k']:2d} {row['recall']:6.3f} {row['mrr']:6.3f} {row['p50_ms']:7.3f} {row['p95_ms']:7.3f} "
+              f"{row['index_mb']:8.2f}")
+
+    best = pick_fastest(rows, args.recall_bar, args.mrr_bar)
+    if best is None:
+        print(f"\nNo configuration reaches recall@k >= {args.recall_bar} and MRR >= {args.mrr_bar}")
+    else:
+        print(f"\nFastest configuration meeting the bar: {json.dumps(best)}")
+
+    Path(args.output).write_text(json.dumps({
+        "labels": args.labels,
+        "documents": len(documents),
+        "recall_bar": args.recall_bar,
+        "mrr_bar": args.mrr_bar,
+        "recommended": best,
+        "results": rows,
+    }, indent=2), encoding="utf-8")
+    print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
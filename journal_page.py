@@ -1,7 +1,6 @@
 import streamlit as st
 from datetime import datetime
-from openai import OpenAI
-import os
+from llm_gateway import chat_completion
 from db_utils import (
     save_journal_entry as db_save_journal,
     load_journal_entries as db_load_journal,
@@ -38,8 +37,6 @@ def get_latest_emotion():
 
 def generate_journal_prompt(emotion_data):
     """Generate an AI-guided journal prompt based on the user's last message"""
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    
     # Get the user's most recent chat message
     user_messages = get_recent_chat_messages()
     
@@ -73,8 +70,7 @@ Good examples:
 Keep it brief, specific, and connected to their LAST message. Just provide the prompt, nothing else."""
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        response = chat_completion(
             messages=[
                 {"role": "system", "content": "You are Juno, a creative AI companion for teens. Generate brief, specific journal prompts based on what the user just shared."},
                 {"role": "user", "content": prompt}
@@ -0,0 +1,181 @@
+"""Shared, pooled OpenAI client for every model call in the app"""
+from __future__ import annotations
+import os
+import re
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+import httpx
+from openai import DefaultHttpxClient, OpenAI
+
+MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+# One client per server process: its connection pool keeps TLS sessions alive between
+# turns, so only the first call pays for connection setup. Idle connections are kept
+# well past the time a user takes to type a reply (httpx drops them after 5s by default).
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE", "120"))
+
+_client = None
+_client_lock = threading.Lock()
+# Calls beyond LLM_MAX_CONCURRENCY wait (up to the timeout) for a free slot
+_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+# Prompt-cache accounting from the API usage fields: process totals, plus the last call
+# per thread (each Streamlit session runs in its own thread)
+_usage_lock = threading.Lock()
+_usage_totals = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+_last_usage = threading.local()
+
+def _record_usage(usage) -> None:
+    """Add one call's usage (prompt, cached and completion tokens) to the totals"""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    last = {
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "cached_tokens": getattr(details, "cached_tokens", None) or 0,
+        "completion_tokens": usage.completion_tokens or 0,
+    }
+    last["cached_ratio"] = round(last["cached_tokens"] / last["prompt_tokens"], 4) if last["prompt_tokens"] else 0.0
+    _last_usage.value = last
+    with _usage_lock:
+        _usage_totals["calls"] += 1
+        for key in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+            _usage_totals[key] += last[key]
+
+def usage_report() -> Dict[str, Any]:
+    """Token totals with the share of prompt tokens served from the provider's prompt cache"""
+    with _usage_lock:
+        totals = dict(_usage_totals)
+    totals["cached_ratio"] = round(totals["cached_tokens"] / totals["prompt_tokens"], 4) if totals["prompt_tokens"] else 0.0
+    totals["last"] = getattr(_last_usage, "value", None)
+    return totals
+
+def get_client() -> Optional[OpenAI]:
+    """Return the shared client, creating it on first use; None if no API key is set"""
+    global _client
+    if _client is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            return None
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=api_key,
+                    timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS),
+                    max_retries=LLM_MAX_RETRIES,
+                    http_client=DefaultHttpxClient(
+                        limits=httpx.Limits(
+                            max_connections=LLM_MAX_CONCURRENCY,
+                            max_keepalive_connections=LLM_MAX_CONCURRENCY,
+                            keepalive_expiry=LLM_KEEPALIVE_SECONDS,
+                        )
+                    ),
+                )
+    return _client
+
+def chat_completion(**kwargs: Any):
+    """Create a chat completion through the shared client (model defaults to MODEL)"""
+    client = get_client()
+    if client is None:
+        raise RuntimeError("OPENAI_API_KEY is not set")
+    _last_usage.value = None
+    if not _slots.acquire(timeout=LLM_TIMEOUT_SECONDS):
+        raise RuntimeError("Too many model calls in flight")
+    try:
+        response = client.chat.completions.create(**{"model": MODEL, **kwargs})
+    finally:
+        _slots.release()
+    _record_usage(response.usage)
+    return response
+
+def stream_chat_completion(**kwargs: Any) -> Iterator[str]:
+    """Stream a chat completion through the shared client, yielding content deltas as they arrive"""
+    client = get_client()
+    if client is None:
+        raise RuntimeError("OPENAI_API_KEY is not set")
+    _last_usage.value = None
+    if not _slots.acquire(timeout=LLM_TIMEOUT_SECONDS):
+        raise RuntimeError("Too many model calls in flight")
+    try:
+        # The slot is held until the stream is drained or closed; usage arrives in the last chunk
+        request = {"model": MODEL, "stream_options": {"include_usage": True}, **kwargs, "stream": True}
+        with client.chat.completions.create(**request) as stream:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    _record_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+    finally:
+        _slots.release()
+
+class JsonStringFieldStream:
+    """Decode one string field of a JSON object while the object is still arriving.
+
+    feed() takes raw JSON text as it streams in and returns whatever part of the field's
+    value became decodable; escapes split across deltas wait for the rest.
+    """
+    
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+    
+    def __init__(self, field: str):
+        self._key = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._buffer = ""
+        self._pos = None  # Next undecoded character of the value
+        self.value = ""
+        self.done = False
+    
+    @property
+    def text(self) -> str:
+        """All raw JSON fed so far"""
+        return self._buffer
+    
+    def feed(self, delta: str) -> str:
+        self._buffer += delta
+        if self.done:
+            return ""
+        if self._pos is None:
+            match = self._key.search(self._buffer)
+            if match is None:
+                return ""
+            self._pos = match.end()
+        
+        buf, i, out = self._buffer, self._pos, []
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch != "\\":
+                out.append(ch)
+                i += 1
+                continue
+            if i + 1 >= len(buf):
+                break
+            if buf[i + 1] != "u":
+                out.append(self._ESCAPES.get(buf[i + 1], buf[i + 1]))
+                i += 2
+                continue
+            if i + 6 > len(buf):
+                break
+            code = int(buf[i + 2:i + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                # High surrogate: decode together with the low half that follows
+                if i + 12 > len(buf):
+                    break
+                if buf[i + 6:i + 8] == "\\u":
+                    low = int(buf[i + 8:i + 12], 16)
+                    out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                    i += 12
+                    continue
+            out.append(chr(code))
+            i += 6
+        self._pos = i
+        decoded = "".join(out)
+        self.value += decoded
+        return decoded
@@ -63,6 +63,16 @@ def format_cards_for_prompt(cards: List[Dict[str, Any]]) -> str:
         )
     return "\n\n".join(blocks)
 
+# Formatted catalog for the most recently seen cards list: (cards list, catalog text)
+_catalog_cache = None
+
+def format_card_catalog(cards: List[Dict[str, Any]]) -> str:
+    """Every skill card, formatted once per cards list so the prompt prefix is byte-identical across turns"""
+    global _catalog_cache
+    if _catalog_cache is None or _catalog_cache[0] is not cards:
+        _catalog_cache = (cards, "Coping skill card catalog (use only these):\n\n" + format_cards_for_prompt(cards))
+    return _catalog_cache[1]
+
 def format_documents_for_prompt(documents: List[Dict[str, Any]]) -> str:
     """Format retrieved documents for inclusion in the prompt"""
     if not documents:
@@ -89,3 +99,14 @@ def format_combined_context(skill_cards: List[Dict[str, Any]], documents: List[D
     
     return "\n\n".join(context_parts)
 
+def format_turn_context(skill_cards: List[Dict[str, Any]], documents: List[Dict[str, Any]]) -> str:
+    """Per-message retrieval context; cards are named by title since the catalog already holds their text"""
+    context_parts = []
+    
+    if skill_cards:
+        context_parts.append("Skill cards that best fit this message: " + "; ".join(c.get("title") for c in skill_cards))
+    
+    if documents:
+        context_parts.append("=== ADDITIONAL RESOURCES ===\n" + format_documents_for_prompt(documents))
+    
+    return "\n\n".join(context_parts)
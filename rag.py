@@ -1,233 +1,2156 @@
 from __future__ import annotations
 import json
+import gzip
+import heapq
+from itertools import islice
+import re
+import hashlib
+import zlib
+import shutil
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import Mapping as MappingABC, Sequence
+import multiprocessing
+import signal
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Dict, Any
+from types import MappingProxyType
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Mapping, Tuple, NamedTuple
 import os
 from docx import Document
 from PyPDF2 import PdfReader
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, CountVectorizer, HashingVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
 import numpy as np
 
-# Cache for loaded documents
-_documents_cache = None
-_vectorizer_cache = None
-_tfidf_matrix_cache = None
+# Inverted tag index for the most recently loaded skill cards: (cards list, tag -> card positions)
+_card_index_cache = None
 
-def load_cards(path: str = "data/skill_cards.json") -> List[Dict[str, Any]]:
-    return json.loads(Path(path).read_text(encoding="utf-8"))
+# Bounded LRU/TTL cache of retrieve_combined_context results. Entries are keyed on the
+# index generation, which moves (and clears the cache) whenever the index or cards reload.
+CONTEXT_CACHE_SIZE = int(os.getenv("RAG_CONTEXT_CACHE_SIZE", "512"))
+CONTEXT_CACHE_TTL_SECONDS = float(os.getenv("RAG_CONTEXT_CACHE_TTL", "300"))
+_context_cache = OrderedDict()
+_context_cache_lock = threading.Lock()
+_context_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_index_generation = 0
+
+# Incremental updates are appended as a delta with the fitted vocabulary and idf;
+# once the delta passes REFIT_DELTA_RATIO of the index a background refit replaces it
+REFIT_DELTA_RATIO = 0.25
+_refit_thread = None
+_refit_lock = threading.Lock()
+
+DATA_DIR = "data/teenage_research"
+CARDS_PATH = "data/skill_cards.json"
+
+# Extracted PDF/DOCX text, stored as gzip blobs keyed by the sha256 of the source file
+TEXT_CACHE_DIR = os.getenv("RAG_TEXT_CACHE_DIR", "data/.rag_text_cache")
+
+# Ingestion fans out across a process pool; each file gets its own parse timeout
+INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", "0")) or (os.cpu_count() or 1)
+INGEST_TIMEOUT_SECONDS = int(os.getenv("RAG_INGEST_TIMEOUT", "120"))
+# Ingest workers start from a clean process rather than a fork of the (multithreaded)
+# server, whose other threads may hold locks at the moment of the fork
+INGEST_START_METHOD = os.getenv("RAG_INGEST_START_METHOD") or (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+# Starting the pool takes seconds, so only this many PDF/DOCX files still to parse pay
+# for it; text files and cached extractions are always read in-process
+INGEST_POOL_MIN_FILES = 3
+
+# Persisted index location (fitted vocabulary, idf weights, matrix and document metadata)
+INDEX_DIR = os.getenv("RAG_INDEX_DIR", "data/.rag_index")
+INDEX_FORMAT_VERSION = 7
+
+# Offline-built retrieval artifact (see build_index.py). When set, the index and cards are
+# loaded from it read-only: sources are never parsed and no index is written at runtime.
+ARTIFACT_DIR = os.getenv("RAG_ARTIFACT") or None
+
+# Corpus store: "files" keeps chunk text in the index; "sqlite" ingests documents and chunks
+# into the app database once (see database.py) and reads chunk text back by id on demand
+CORPUS_STORE = os.getenv("RAG_CORPUS_STORE", "files")
+CORPUS_FETCH_BATCH = 500
+# How often a store-backed index checks the database for changes made by other workers
+CORPUS_POLL_SECONDS = float(os.getenv("RAG_CORPUS_POLL_SECONDS", "5"))
+SUPPORTED_SUFFIXES = ['.pdf', '.docx', '.txt']
+
+VECTORIZER_PARAMS = {
+    "max_features": 1000,
+    "stop_words": "english",
+    "ngram_range": (1, 2),
+}
+
+# Streaming build: hash features into a fixed width instead of fitting a vocabulary and
+# vectorize chunks in batches as documents are read, so no corpus-wide text list exists.
+# BM25 is weighted from the same hashed counts; there is no LSA ("lsa" ranks with TF-IDF)
+STREAMING_BUILD = os.getenv("RAG_STREAMING_BUILD", "0") == "1"
+HASH_FEATURES = int(os.getenv("RAG_HASH_FEATURES", 2 ** 16))
+STREAM_BATCH_CHUNKS = 512
+
+# Chunking: paragraphs are packed into windows of about CHUNK_TARGET_CHARS
+CHUNK_TARGET_CHARS = 800
+CHUNK_MAX_CHARS = 1200
+CHUNK_MIN_CHARS = 50
+
+# Near-duplicate collapsing at ingest: MinHash signatures over word shingles, bucketed by
+# LSH bands; a document or chunk whose estimated Jaccard similarity to an earlier one is at
+# least DEDUP_THRESHOLD is dropped. 0 disables it.
+DEDUP_THRESHOLD = float(os.getenv("RAG_DEDUP_THRESHOLD", 0.85))
+SHINGLE_WORDS = 5
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+_MINHASH_PRIME = (1 << 61) - 1
+_minhash_rng = np.random.RandomState(0)
+_MINHASH_A = _minhash_rng.randint(1, 1 << 29, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+_MINHASH_B = _minhash_rng.randint(0, 1 << 29, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+
+# Message keywords that select skill card tags when no intent is known yet
+CARD_KEYWORDS = {
+    "anxious": ["anxiety", "panic", "overwhelm", "worry"],
+    "stressed": ["stress", "overwhelm"],
+    "sad": ["sadness", "grief", "loneliness"],
+    "angry": ["anger", "frustration"],
+    "sleep": ["sleep", "tired"],
+    "test": ["test_anxiety", "anxiety"],
+    "social": ["social_anxiety", "anxiety"],
+    "focus": ["focus", "distraction"]
+}
+
+# One pass over the message finds every keyword occurrence; the lookahead lets matches overlap,
+# so this behaves like checking `keyword in message` for each keyword
+_CARD_KEYWORD_PATTERN = re.compile(
+    "(?=(" + "|".join(re.escape(word) for word in sorted(CARD_KEYWORDS, key=len, reverse=True)) + "))"
+)
+
+def _build_card_index(cards: List[Dict[str, Any]]) -> Mapping[str, Tuple[int, ...]]:
+    """Map each tag to the positions of the cards carrying it, in card order"""
+    index = {}
+    for position, card in enumerate(cards):
+        for tag in card.get("tags", []):
+            positions = index.setdefault(tag, [])
+            if not positions or positions[-1] != position:
+                positions.append(position)
+    return MappingProxyType({tag: tuple(positions) for tag, positions in index.items()})
+
+def _card_index(cards: List[Dict[str, Any]]) -> Mapping[str, Tuple[int, ...]]:
+    """Return the tag index for this cards list, building it once per list"""
+    global _card_index_cache
+    if _card_index_cache is None or _card_index_cache[0] is not cards:
+        _card_index_cache = (cards, _build_card_index(cards))
+    return _card_index_cache[1]
+
+def match_card_tags(message: str) -> set:
+    """Return the card tags selected by keywords in a message"""
+    matched_tags = set()
+    for word in _CARD_KEYWORD_PATTERN.findall(message.lower()):
+        matched_tags.update(CARD_KEYWORDS[word])
+    return matched_tags
+
+def _select_cards(cards: List[Dict[str, Any]], tags, k: int) -> List[int]:
+    """Positions of the first k cards carrying any of the tags"""
+    index = _card_index(cards)
+    postings = [index[tag] for tag in tags if tag in index]
+    selected = []
+    for position in heapq.merge(*postings):
+        if selected and selected[-1] == position:
+            continue
+        selected.append(position)
+        if len(selected) >= k:
+            break
+    return selected
+
+def load_cards(path: str = CARDS_PATH) -> List[Dict[str, Any]]:
+    """Load skill cards and build their tag index"""
+    cards = json.loads(Path(path).read_text(encoding="utf-8"))
+    _card_index(cards)
+    _invalidate_context_cache()
+    return cards
+
+def _iter_document_text(file_path: str) -> Iterator[str]:
+    """Yield extracted text one PDF page (or DOCX paragraph) at a time"""
+    if file_path.endswith('.pdf'):
+        reader = PdfReader(file_path)
+        for page in reader.pages:
+            yield (page.extract_text() or "") + "\n"
+    elif file_path.endswith('.docx'):
+        doc = Document(file_path)
+        for i, paragraph in enumerate(doc.paragraphs):
+            yield ("\n" if i else "") + paragraph.text
+
+def _text_cache_path(content_hash: str) -> Path:
+    return Path(TEXT_CACHE_DIR) / content_hash[:2] / f"{content_hash}.txt.gz"
+
+def _extract_to_cache(file_path: str, cache_path: Path) -> str:
+    """Stream extracted text into a gzip blob, then move it into place"""
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    staging = cache_path.with_name(f"{cache_path.name}.tmp-{os.getpid()}")
+    parts = []
+    try:
+        with gzip.open(staging, 'wt', encoding='utf-8') as blob:
+            for part in _iter_document_text(file_path):
+                blob.write(part)
+                parts.append(part)
+        os.replace(staging, cache_path)
+    finally:
+        if staging.exists():
+            staging.unlink()
+    return "".join(parts)
+
+def _read_document(file_path: str) -> str:
+    """Load text content from PDF or DOCX file, reusing previously extracted text for unchanged files"""
+    if file_path.endswith('.txt'):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    elif file_path.endswith(('.pdf', '.docx')):
+        cache_path = _text_cache_path(_hash_file(Path(file_path)))
+        if cache_path.exists():
+            with gzip.open(cache_path, 'rt', encoding='utf-8') as blob:
+                return blob.read()
+        return _extract_to_cache(file_path, cache_path)
+    return ""
 
 def load_document(file_path: str) -> str:
-    """Load text content from PDF or DOCX file"""
+    """Load text content from PDF or DOCX file; "" if it cannot be read"""
     try:
-        if file_path.endswith('.pdf'):
-            reader = PdfReader(file_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-            return text
-        elif file_path.endswith('.docx'):
-            doc = Document(file_path)
-            text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-            return text
-        elif file_path.endswith('.txt'):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
+        return _read_document(file_path)
     except Exception as e:
         print(f"Error loading {file_path}: {e}")
         return ""
-    return ""
 
-def load_all_documents(data_dir: str = "data/teenage_research") -> List[Dict[str, Any]]:
-    """Load all documents from the data directory"""
-    global _documents_cache
+def _split_long_paragraph(paragraph: str) -> List[str]:
+    """Break an oversized paragraph (common in PDF text) into word-aligned windows"""
+    if len(paragraph) <= CHUNK_MAX_CHARS:
+        return [paragraph]
+    pieces = []
+    words = []
+    length = 0
+    for word in paragraph.split():
+        if words and length + len(word) > CHUNK_TARGET_CHARS:
+            pieces.append(" ".join(words))
+            words = []
+            length = 0
+        words.append(word)
+        length += len(word) + 1
+    if words:
+        pieces.append(" ".join(words))
+    return pieces
+
+def chunk_document(content: str) -> List[str]:
+    """Split document text into paragraph windows of roughly CHUNK_TARGET_CHARS"""
+    paragraphs = [p.strip() for p in content.split('\n\n') if len(p.strip()) > CHUNK_MIN_CHARS]
+    if not paragraphs and content.strip():
+        paragraphs = [content.strip()]
+    
+    chunks = []
+    window = []
+    window_len = 0
+    for paragraph in paragraphs:
+        for piece in _split_long_paragraph(paragraph):
+            if window and window_len + len(piece) > CHUNK_TARGET_CHARS:
+                chunks.append("\n\n".join(window))
+                window = []
+                window_len = 0
+            window.append(piece)
+            window_len += len(piece) + 2
+    if window:
+        chunks.append("\n\n".join(window))
+    return chunks
+
+def _minhash_signature(text: str) -> Optional[np.ndarray]:
+    """MinHash of the text's word shingles; None if it has no words"""
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(len(words) - SHINGLE_WORDS + 1, 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    signature = np.full(MINHASH_PERMUTATIONS, _MINHASH_PRIME, dtype=np.uint64)
+    # Blocks keep the shingles x permutations product small for long documents
+    for start in range(0, len(hashes), 4096):
+        block = hashes[start:start + 4096, None]
+        signature = np.minimum(signature, ((block * _MINHASH_A + _MINHASH_B) % _MINHASH_PRIME).min(axis=0))
+    return (signature & 0xFFFFFFFF).astype(np.uint32)
+
+class NearDuplicateFilter:
+    """Online MinHash/LSH near-duplicate detector.
+
+    add(key, text) returns the key of an earlier text whose estimated Jaccard similarity
+    is at least threshold; otherwise it remembers the text and returns None.
+    """
+    
+    def __init__(self, threshold: float = DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self._keys = []
+        self._signatures = []
+        self._buckets = {}
+    
+    def add(self, key: str, text: str) -> Optional[str]:
+        if self.threshold <= 0:
+            return None
+        signature = _minhash_signature(text)
+        if signature is None:
+            return None
+        
+        rows = MINHASH_PERMUTATIONS // LSH_BANDS
+        bands = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(LSH_BANDS)]
+        checked = set()
+        for band in bands:
+            for candidate in self._buckets.get(band, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                    return self._keys[candidate]
+        
+        position = len(self._keys)
+        self._keys.append(key)
+        self._signatures.append(signature)
+        for band in bands:
+            self._buckets.setdefault(band, []).append(position)
+        return None
+
+def _report_duplicates(duplicates: Dict[str, List[Dict[str, str]]]) -> None:
+    """Print what near-duplicate collapsing dropped"""
+    if duplicates["documents"] or duplicates["chunks"]:
+        print(f"Dropped {len(duplicates['documents'])} near-duplicate documents and "
+              f"{len(duplicates['chunks'])} near-duplicate chunks")
+        for entry in duplicates["documents"]:
+            print(f"  {entry['path']} duplicates {entry['duplicate_of']}")
+
+def build_chunks(documents: List[Dict[str, Any]],
+                 duplicates: Optional[Dict[str, List[Dict[str, str]]]] = None) -> List[Dict[str, Any]]:
+    """Chunk every document once; each chunk records the index of its document.
+
+    Near-duplicates of earlier chunks are dropped and, if a duplicates report is
+    given, recorded in its "chunks" list.
+    """
+    chunks = []
+    chunk_filter = NearDuplicateFilter()
+    for doc_id, doc in enumerate(documents):
+        for text in chunk_document(doc["content"]):
+            original = chunk_filter.add(doc["path"], text)
+            if original is not None:
+                if duplicates is not None:
+                    duplicates["chunks"].append({"path": doc["path"], "duplicate_of": original})
+                continue
+            chunks.append({"doc_id": doc_id, "text": text})
+    return chunks
+
+def _raise_ingest_timeout(signum, frame):
+    raise TimeoutError("parsing timed out")
+
+def _load_document_in_worker(file_path: str, timeout: int) -> str:
+    """Pool entry point: parse one file, giving up after timeout seconds where SIGALRM exists"""
+    if not hasattr(signal, "SIGALRM"):
+        return _read_document(file_path)
+    signal.signal(signal.SIGALRM, _raise_ingest_timeout)
+    signal.alarm(timeout)
+    try:
+        return _read_document(file_path)
+    finally:
+        signal.alarm(0)
+
+def _ingest_pool(workers: int) -> ProcessPoolExecutor:
+    context = multiprocessing.get_context(INGEST_START_METHOD)
+    if INGEST_START_METHOD == "forkserver":
+        # Workers fork from a server that has already imported this module
+        context.set_forkserver_preload([__name__])
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+def _needs_parsing(file_path: str) -> bool:
+    """True for a PDF/DOCX file whose text is not in the extraction cache yet"""
+    if not file_path.endswith(('.pdf', '.docx')):
+        return False
+    try:
+        return not _text_cache_path(_hash_file(Path(file_path))).exists()
+    except OSError:
+        # Unreadable: the in-process read reports it
+        return False
+
+def _read_in_process(file_path: str, failed: Optional[List[str]]) -> str:
+    """Read one file in this process; "" (and appended to failed) if it cannot be read"""
+    try:
+        return _read_document(file_path)
+    except Exception as e:
+        print(f"Error loading {file_path}: {e}")
+        if failed is not None:
+            failed.append(file_path)
+        return ""
+
+def iter_documents_parallel(file_paths: List[str], workers: int = INGEST_WORKERS,
+                            timeout: int = INGEST_TIMEOUT_SECONDS,
+                            failed: Optional[List[str]] = None) -> Iterator[str]:
+    """Extract text from many files, yielding contents in input order.
+
+    Text files and PDF/DOCX files already in the extraction cache are read in-process.
+    The rest are parsed in a process pool once there are INGEST_POOL_MIN_FILES of them;
+    a file that fails, times out or takes its worker down comes back as "" (and is
+    appended to failed) so the rest of the corpus still loads.
+    """
+    to_parse = [path for path in file_paths if _needs_parsing(path)]
+    if workers <= 1 or len(to_parse) < INGEST_POOL_MIN_FILES:
+        for path in file_paths:
+            yield _read_in_process(path, failed)
+        return
+    
+    parsed = _iter_pooled(to_parse, workers, timeout, failed)
+    pooled = set(to_parse)
+    try:
+        for path in file_paths:
+            yield next(parsed) if path in pooled else _read_in_process(path, failed)
+    finally:
+        # Shuts the pool down even if the caller stops early
+        parsed.close()
+
+def _iter_pooled(file_paths: List[str], workers: int, timeout: int,
+                 failed: Optional[List[str]]) -> Iterator[str]:
+    """Parse files in a process pool, yielding contents in input order.
+
+    At most 2 * workers files are in flight, so extracted text never piles up. When a
+    worker dies the pool is replaced and the files that were in flight are rerun one at
+    a time, so only the file responsible is lost.
+    """
+    workers = min(workers, len(file_paths))
+    pool = _ingest_pool(workers)
+    in_flight = deque()  # (index, future) in input order
+    next_index = 0
+    isolate_until = -1  # Files up to this index were in flight when a worker died
+    try:
+        while in_flight or next_index < len(file_paths):
+            head = in_flight[0][0] if in_flight else next_index
+            window = 1 if head <= isolate_until else 2 * workers
+            while next_index < len(file_paths) and len(in_flight) < window:
+                try:
+                    future = pool.submit(_load_document_in_worker, file_paths[next_index], timeout)
+                except BrokenProcessPool:
+                    # A file already in flight took the pool down; its result says so below
+                    break
+                in_flight.append((next_index, future))
+                next_index += 1
+            
+            index, future = in_flight.popleft()
+            path = file_paths[index]
+            try:
+                content = future.result()
+            except BrokenProcessPool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = _ingest_pool(workers)
+                if index > isolate_until:
+                    # Every file in flight died with the pool; rerun them alone to find the culprit
+                    isolate_until = next_index - 1
+                    next_index = index
+                    in_flight.clear()
+                    continue
+                print(f"Error loading {path}: its worker process died")
+                content = ""
+                if failed is not None:
+                    failed.append(path)
+            except Exception as e:
+                print(f"Error loading {path}: {e}")
+                content = ""
+                if failed is not None:
+                    failed.append(path)
+            yield content
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+def load_documents_parallel(file_paths: List[str], workers: int = INGEST_WORKERS,
+                            timeout: int = INGEST_TIMEOUT_SECONDS,
+                            failed: Optional[List[str]] = None) -> List[str]:
+    """Extract text from many files (see iter_documents_parallel), returning contents in input order"""
+    return list(iter_documents_parallel(file_paths, workers, timeout, failed))
+
+def _hash_file(file_path: Path) -> str:
+    """Return the sha256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _source_files(data_path: Path) -> List[Path]:
+    """List supported source files in a stable order"""
+    return sorted(p for p in data_path.glob("*") if p.suffix in SUPPORTED_SUFFIXES)
+
+def _build_manifest(files: List[Path]) -> Dict[str, Dict[str, Any]]:
+    """Fingerprint source files by mtime, size and content hash"""
+    manifest = {}
+    for file_path in files:
+        stat = file_path.stat()
+        manifest[str(file_path)] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": _hash_file(file_path),
+        }
+    return manifest
+
+def _file_is_current(saved: Dict[str, Any], file_path: Path) -> bool:
+    """Check one file against its saved fingerprint.
+
+    Files whose mtime and size are unchanged are trusted without rereading them;
+    anything else is rehashed, so a touched-but-identical file does not force a rebuild.
+    """
+    stat = file_path.stat()
+    if stat.st_mtime_ns == saved["mtime_ns"] and stat.st_size == saved["size"]:
+        return True
+    return _hash_file(file_path) == saved["sha256"]
+
+def _manifest_is_current(manifest: Dict[str, Dict[str, Any]], files: List[Path]) -> bool:
+    """Check a saved manifest against the files on disk"""
+    if sorted(manifest) != [str(p) for p in files]:
+        return False
+    return all(_file_is_current(manifest[str(p)], p) for p in files)
+
+class ChunkStore(Sequence):
+    """Read-only chunk list backed by one UTF-8 blob plus offset and doc-id arrays.
+
+    Items are {"doc_id", "text"} dicts built on access, so the index holds no per-chunk
+    Python objects. A store loaded from disk memory-maps all three parts.
+    """
+    
+    def __init__(self, doc_ids: np.ndarray, offsets: np.ndarray, blob):
+        self.doc_ids = doc_ids
+        self.offsets = offsets
+        self.blob = blob
+    
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[Dict[str, Any]]) -> "ChunkStore":
+        writer = _ChunkStoreWriter()
+        for chunk in chunks:
+            writer.append(chunk["doc_id"], chunk["text"])
+        return writer.finish()
+    
+    @classmethod
+    def load(cls, directory: Path) -> "ChunkStore":
+        blob_path = directory / "chunk_text.bin"
+        blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if blob_path.stat().st_size else b""
+        return cls(np.load(directory / "chunk_doc_ids.npy", mmap_mode="r"),
+                   np.load(directory / "chunk_offsets.npy", mmap_mode="r"), blob)
+    
+    def save(self, directory: Path) -> None:
+        np.save(directory / "chunk_doc_ids.npy", np.asarray(self.doc_ids))
+        np.save(directory / "chunk_offsets.npy", np.asarray(self.offsets))
+        with open(directory / "chunk_text.bin", "wb") as f:
+            f.write(self.blob)
+    
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        return {"doc_id": int(self.doc_ids[i]), "text": self.text(i)}
+    
+    def text(self, i: int) -> str:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+    
+    def texts(self) -> Iterator[str]:
+        return (self.text(i) for i in range(len(self)))
+    
+    def texts_at(self, positions: List[int]) -> List[Optional[str]]:
+        return [self.text(i) for i in positions]
+    
+    def select(self, keep: np.ndarray, doc_ids: np.ndarray) -> "ChunkStore":
+        """A new store with only the chunks where keep is True, relabelled with doc_ids"""
+        lengths = np.diff(np.asarray(self.offsets))
+        offsets = np.zeros(np.count_nonzero(keep) + 1, dtype=np.int64)
+        np.cumsum(lengths[keep], out=offsets[1:])
+        blob = np.frombuffer(self.blob, dtype=np.uint8)[np.repeat(keep, lengths)].tobytes()
+        return ChunkStore(np.asarray(doc_ids, dtype=np.int32), offsets, blob)
+    
+    def extend(self, doc_id: int, texts: List[str]) -> "ChunkStore":
+        """A new store with texts appended as chunks of doc_id"""
+        encoded = [text.encode("utf-8") for text in texts]
+        offsets = np.asarray(self.offsets)
+        added = offsets[-1] + np.cumsum([len(text) for text in encoded], dtype=np.int64)
+        return ChunkStore(np.concatenate([np.asarray(self.doc_ids), np.full(len(encoded), doc_id, dtype=np.int32)]),
+                          np.concatenate([offsets, added]), bytes(self.blob) + b"".join(encoded))
+    
+    def nbytes(self) -> int:
+        return int(np.asarray(self.doc_ids).nbytes + np.asarray(self.offsets).nbytes + len(self.blob))
+    
+    def is_mapped(self) -> bool:
+        return isinstance(self.blob, np.memmap)
+
+class CorpusChunkStore(Sequence):
+    """Chunk list whose text stays in the corpus database; only chunk and doc ids are held.
+
+    Items are {"doc_id", "text"} dicts read by id on access, so every worker serves the
+    same stored corpus without keeping its own copy of the text. ids are unique (the
+    database never reuses them) but not always ascending, since catch-up appends whole
+    documents; a store loaded from disk memory-maps both arrays.
+    """
+    
+    def __init__(self, ids: np.ndarray, doc_ids: np.ndarray):
+        self.ids = ids
+        self.doc_ids = doc_ids
+        self._sorted = None  # (ids ascending, their positions), built on the first lookup
+    
+    @classmethod
+    def load(cls, directory: Path) -> "CorpusChunkStore":
+        return cls(np.load(directory / "chunk_ids.npy", mmap_mode="r"),
+                   np.load(directory / "chunk_doc_ids.npy", mmap_mode="r"))
+    
+    def save(self, directory: Path) -> None:
+        np.save(directory / "chunk_ids.npy", np.asarray(self.ids))
+        np.save(directory / "chunk_doc_ids.npy", np.asarray(self.doc_ids))
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        return {"doc_id": int(self.doc_ids[i]), "text": self.text(i)}
+    
+    def text(self, i: int) -> str:
+        # A chunk replaced by a later ingest reads as empty until the index catches up
+        chunk_id = int(self.ids[i])
+        return _corpus_db().get_corpus_chunk_texts([chunk_id]).get(chunk_id, "")
+    
+    def texts(self) -> Iterator[str]:
+        for start in range(0, len(self), CORPUS_FETCH_BATCH):
+            batch = [int(chunk_id) for chunk_id in self.ids[start:start + CORPUS_FETCH_BATCH]]
+            found = _corpus_db().get_corpus_chunk_texts(batch)
+            for chunk_id in batch:
+                yield found.get(chunk_id, "")
+    
+    def texts_at(self, positions: List[int]) -> List[Optional[str]]:
+        """Text of the chunks at positions, in one query; None for chunks no longer in the database"""
+        chunk_ids = [int(self.ids[i]) for i in positions]
+        found = _corpus_db().get_corpus_chunk_texts(chunk_ids)
+        return [found.get(chunk_id) for chunk_id in chunk_ids]
+    
+    def positions(self, chunk_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Map database chunk ids to positions; returns (positions, mask of ids in this store)"""
+        if not len(self.ids):
+            return np.zeros(len(chunk_ids), dtype=np.int64), np.zeros(len(chunk_ids), dtype=bool)
+        if self._sorted is None:
+            ids = np.asarray(self.ids)
+            order = np.argsort(ids, kind="stable")
+            self._sorted = (ids[order], order)
+        sorted_ids, order = self._sorted
+        found = np.minimum(np.searchsorted(sorted_ids, chunk_ids), len(sorted_ids) - 1)
+        return order[found], sorted_ids[found] == chunk_ids
+    
+    def select(self, keep: np.ndarray, doc_ids: np.ndarray) -> "CorpusChunkStore":
+        """A new store with only the chunks where keep is True, relabelled with doc_ids"""
+        return CorpusChunkStore(np.asarray(self.ids)[keep], np.asarray(doc_ids, dtype=np.int32))
+    
+    def extend(self, doc_id: int, chunk_ids: List[int]) -> "CorpusChunkStore":
+        """A new store with database chunks appended as chunks of doc_id"""
+        return CorpusChunkStore(
+            np.concatenate([np.asarray(self.ids), np.asarray(chunk_ids, dtype=np.int64)]),
+            np.concatenate([np.asarray(self.doc_ids), np.full(len(chunk_ids), doc_id, dtype=np.int32)])
+        )
+    
+    def nbytes(self) -> int:
+        return int(self.ids.nbytes + self.doc_ids.nbytes)
+    
+    def is_mapped(self) -> bool:
+        return isinstance(self.ids, np.memmap)
+
+class _ChunkStoreWriter:
+    """Append chunks one at a time into the compact ChunkStore layout"""
+    
+    def __init__(self):
+        self.doc_ids = array("i")
+        self.offsets = array("q", [0])
+        self.blob = bytearray()
+    
+    def append(self, doc_id: int, text: str) -> None:
+        self.blob += text.encode("utf-8")
+        self.doc_ids.append(doc_id)
+        self.offsets.append(len(self.blob))
+    
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+    
+    def finish(self) -> ChunkStore:
+        return ChunkStore(np.frombuffer(self.doc_ids, dtype=np.int32), np.frombuffer(self.offsets, dtype=np.int64),
+                          bytes(self.blob))
+
+class TermTable(MappingABC):
+    """Read-only term -> column mapping stored as sorted UTF-8 terms in one blob.
+
+    Lookups binary-search the blob, so a large vocabulary costs a few bytes per term
+    instead of a Python dict entry; loaded from disk, the table is memory-mapped.
+    """
+    
+    def __init__(self, blob, offsets: np.ndarray, columns: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+        self.columns = columns
+    
+    @classmethod
+    def from_vocabulary(cls, vocabulary: Mapping[str, int]) -> "TermTable":
+        terms = sorted(vocabulary)
+        encoded = [term.encode("utf-8") for term in terms]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(term) for term in encoded], out=offsets[1:])
+        return cls(b"".join(encoded), offsets, np.array([vocabulary[term] for term in terms], dtype=np.int32))
     
-    if _documents_cache is not None:
-        return _documents_cache
+    @classmethod
+    def load(cls, directory: Path, prefix: str) -> "TermTable":
+        blob_path = directory / f"{prefix}_terms.bin"
+        blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if blob_path.stat().st_size else b""
+        return cls(blob, np.load(directory / f"{prefix}_term_offsets.npy", mmap_mode="r"),
+                   np.load(directory / f"{prefix}_term_columns.npy", mmap_mode="r"))
+    
+    def save(self, directory: Path, prefix: str) -> None:
+        with open(directory / f"{prefix}_terms.bin", "wb") as f:
+            f.write(self.blob)
+        np.save(directory / f"{prefix}_term_offsets.npy", np.asarray(self.offsets))
+        np.save(directory / f"{prefix}_term_columns.npy", np.asarray(self.columns))
+    
+    def _term(self, i: int) -> bytes:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+    
+    def __getitem__(self, term: str) -> int:
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self.columns)
+        # UTF-8 byte order matches the code point order the terms were sorted in
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.columns) and self._term(lo) == key:
+            return int(self.columns[lo])
+        raise KeyError(term)
     
+    def __iter__(self) -> Iterator[str]:
+        return (self._term(i).decode("utf-8") for i in range(len(self.columns)))
+    
+    def __len__(self) -> int:
+        return len(self.columns)
+    
+    def nbytes(self) -> int:
+        return int(np.asarray(self.offsets).nbytes + np.asarray(self.columns).nbytes + len(self.blob))
+    
+    def is_mapped(self) -> bool:
+        return isinstance(self.blob, np.memmap)
+
+def _compact(matrix):
+    """float32 CSR with int32 indices - half the bytes of scikit-learn's float64 output"""
+    matrix = sparse.csr_matrix(matrix, dtype=np.float32)
+    matrix.indices = matrix.indices.astype(np.int32, copy=False)
+    matrix.indptr = matrix.indptr.astype(np.int32, copy=False)
+    return matrix
+
+class HashedTfidfVectorizer:
+    """TF-IDF over a fixed-width feature hash, with idf accumulated from streamed counts.
+
+    Provides the parts of a fitted TfidfVectorizer the query side uses (transform, idf_)
+    without a vocabulary, so its size does not grow with the corpus.
+    """
+    
+    def __init__(self, n_features: int = HASH_FEATURES, idf: Optional[np.ndarray] = None):
+        self.n_features = n_features
+        self.hasher = HashingVectorizer(
+            n_features=n_features,
+            stop_words=VECTORIZER_PARAMS["stop_words"],
+            ngram_range=VECTORIZER_PARAMS["ngram_range"],
+            alternate_sign=False,
+            norm=None,
+            dtype=np.float32
+        )
+        self.idf_ = idf
+    
+    def counts(self, texts: Iterable[str]):
+        return self.hasher.transform(texts)
+    
+    def transform(self, texts: Iterable[str]):
+        return normalize(self.counts(texts) @ sparse.diags(self.idf_)).tocsr()
+
+def _vectorizer_config(hashed: bool) -> Dict[str, Any]:
+    """Build settings recorded in the manifest; a saved index is reused only if they match"""
+    config = {
+        **VECTORIZER_PARAMS,
+        "ngram_range": list(VECTORIZER_PARAMS["ngram_range"]),
+        "dedup_threshold": DEDUP_THRESHOLD,
+        "lsa_components": LSA_COMPONENTS if LSA_ENABLED else None,
+    }
+    if hashed:
+        config.update(max_features=None, hash_features=HASH_FEATURES)
+    return config
+
+class IndexSnapshot(NamedTuple):
+    """A complete, immutable retrieval index.
+
+    Updates never modify a snapshot in place; they build a new one and swap it in whole.
+    """
+    documents: List[Dict[str, Any]]
+    chunks: ChunkStore  # Paragraph-window chunks, one per tfidf_matrix row
+    vectorizer: Optional[Any]  # TfidfVectorizer, or HashedTfidfVectorizer for streaming builds
+    tfidf_matrix: Any
+    intent_rows: Dict[str, int]  # Intent -> row of intent_matrix
+    intent_matrix: Any  # Un-normalized TF-IDF vectors of INTENT_KEYWORDS
+    lsa_components: Optional[np.ndarray]
+    lsa_vectors: Optional[np.ndarray]  # Memory-mapped read-only when loaded from disk
+    bm25: Optional[Dict[str, Any]]
+    manifest: Optional[Dict[str, Dict[str, Any]]]  # Source fingerprints, saved with the index
+    delta_chunks: int = 0  # Chunks added or removed since the vectorizer was fitted
+    duplicates: Optional[Dict[str, List[Dict[str, str]]]] = None  # Near-duplicates dropped at ingest
+
+def _complete_snapshot(documents: List[Dict[str, Any]], chunks: List[Dict[str, Any]],
+                       vectorizer: Optional[TfidfVectorizer], tfidf_matrix,
+                       manifest: Optional[Dict[str, Dict[str, Any]]], delta_chunks: int = 0,
+                       previous: Optional[IndexSnapshot] = None,
+                       duplicates: Optional[Dict[str, List[Dict[str, str]]]] = None,
+                       bm25: Optional[Dict[str, Any]] = None,
+                       timings: Optional[Dict[str, float]] = None,
+                       lsa: Optional[bool] = None) -> IndexSnapshot:
+    """Derive intent vectors, LSA vectors and BM25 postings for a new snapshot.
+
+    Intent vectors and SVD components depend only on the vectorizer, so an incremental
+    update reuses them (and the ingest duplicates report) from the previous snapshot and
+    only reprojects the matrix; it passes in BM25 postings it has already patched. A
+    snapshot with a new vectorizer gets new postings too. Chunks are packed into a ChunkStore and matrices into
+    float32 CSR; documents keep metadata only, since results show chunk excerpts.
+    timings, if given, receives the seconds spent on intent vectors, LSA and BM25. lsa
+    overrides LSA_ENABLED for a snapshot with a new vectorizer.
+    """
+    if timings is None:
+        timings = {}
+    if duplicates is None and previous is not None:
+        duplicates = previous.duplicates
+    if not isinstance(chunks, (ChunkStore, CorpusChunkStore)):
+        chunks = ChunkStore.from_chunks(chunks)
+    if tfidf_matrix is not None:
+        tfidf_matrix = _compact(tfidf_matrix)
+    if any("content" in doc for doc in documents):
+        documents = [{key: value for key, value in doc.items() if key != "content"} for doc in documents]
+    if vectorizer is None or len(chunks) == 0:
+        # Nothing to fit (e.g. the last document was removed): serve an empty index
+        return IndexSnapshot(documents, chunks, None, None, {}, None, None, None, None, manifest, 0, duplicates)
+    
+    if previous is not None and previous.vectorizer is vectorizer:
+        intent_rows, intent_matrix = previous.intent_rows, previous.intent_matrix
+        components = previous.lsa_components
+    else:
+        start = time.perf_counter()
+        intent_rows, intent_matrix = _intent_vectors(vectorizer)
+        intent_matrix = _compact(intent_matrix)
+        timings["intent"] = time.perf_counter() - start
+        # A dense SVD of the hashed space would hold LSA_COMPONENTS x HASH_FEATURES floats, more
+        # than the streaming build saves; hashed indexes answer "lsa" queries with TF-IDF instead
+        hashed = isinstance(vectorizer, HashedTfidfVectorizer)
+        lsa = LSA_ENABLED if lsa is None else lsa
+        start = time.perf_counter()
+        components = _lsa_components(tfidf_matrix) if lsa and not hashed else None
+        timings["lsa"] = time.perf_counter() - start
+    start = time.perf_counter()
+    vectors = _lsa_vectors(tfidf_matrix, components)
+    timings["lsa"] = timings.get("lsa", 0.0) + time.perf_counter() - start
+    if bm25 is None:
+        reusable = previous is not None and previous.vectorizer is vectorizer and previous.chunks is chunks
+        start = time.perf_counter()
+        bm25 = previous.bm25 if reusable else _bm25_index(chunks)
+        timings["bm25"] = time.perf_counter() - start
+    return IndexSnapshot(documents, chunks, vectorizer, tfidf_matrix, intent_rows, intent_matrix,
+                         components, vectors, bm25, manifest, delta_chunks, duplicates)
+
+def _save_persisted_index(snapshot: IndexSnapshot, index_dir: str = INDEX_DIR,
+                          cards: Optional[List[Dict[str, Any]]] = None,
+                          cards_source: Optional[Dict[str, Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+    """Write the index (and optionally the skill cards) to a staging directory and swap it into place.
+
+    Returns the written manifest, or None if saving failed.
+    """
+    target = Path(index_dir)
+    staging = target.with_name(f"{target.name}.tmp-{os.getpid()}")
+    try:
+        if staging.exists():
+            shutil.rmtree(staging)
+        staging.mkdir(parents=True)
+        (staging / "documents.json").write_text(json.dumps(snapshot.documents, ensure_ascii=False), encoding="utf-8")
+        snapshot.chunks.save(staging)
+        hashed = isinstance(snapshot.vectorizer, HashedTfidfVectorizer)
+        if not hashed:
+            (staging / "vocabulary.json").write_text(
+                json.dumps({term: int(i) for term, i in snapshot.vectorizer.vocabulary_.items()}, ensure_ascii=False),
+                encoding="utf-8"
+            )
+        np.save(staging / "idf.npy", snapshot.vectorizer.idf_)
+        # Uncompressed: zlib took most of each save, and every incremental update saves
+        sparse.save_npz(staging / "tfidf_matrix.npz", snapshot.tfidf_matrix, compressed=False)
+        if snapshot.lsa_components is not None:
+            np.save(staging / "lsa_components.npy", snapshot.lsa_components)
+            np.save(staging / "lsa_vectors.npy", snapshot.lsa_vectors)
+        if not hashed:
+            snapshot.bm25["vectorizer"].vocabulary_.save(staging, "bm25")
+        sparse.save_npz(staging / "bm25_postings.npz", snapshot.bm25["postings"], compressed=False)
+        np.save(staging / "bm25_idf.npy", snapshot.bm25["idf"])
+        if snapshot.bm25["rows"] is not None:
+            np.save(staging / "bm25_rows.npy", np.asarray(snapshot.bm25["rows"]))
+        if cards is not None:
+            (staging / "cards.json").write_text(json.dumps(cards, ensure_ascii=False), encoding="utf-8")
+            (staging / "card_tags.json").write_text(
+                json.dumps({tag: list(positions) for tag, positions in _build_card_index(cards).items()}),
+                encoding="utf-8"
+            )
+        
+        # Content hashes let a loader verify the files, and together version the build
+        files = {p.name: _hash_file(p) for p in sorted(staging.iterdir())}
+        manifest = {
+            "format_version": INDEX_FORMAT_VERSION,
+            "version": hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()[:16],
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "vectorizer": _vectorizer_config(hashed),
+            "sources": snapshot.manifest,
+            "cards_source": cards_source,
+            "delta_chunks": snapshot.delta_chunks,
+            "duplicates": snapshot.duplicates,
+            "chunk_store": "database" if isinstance(snapshot.chunks, CorpusChunkStore) else "blob",
+            "bm25_avgdl": snapshot.bm25["avgdl"],
+            "files": files,
+        }
+        (staging / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+        previous = target.with_name(f"{target.name}.old-{os.getpid()}")
+        if target.exists():
+            target.rename(previous)
+        staging.rename(target)
+        shutil.rmtree(previous, ignore_errors=True)
+    except Exception as e:
+        print(f"Error saving document index to {index_dir}: {e}")
+        shutil.rmtree(staging, ignore_errors=True)
+        return None
+    return manifest
+
+def _remap_chunks(snapshot: IndexSnapshot, manifest: Optional[Dict[str, Any]],
+                  index_dir: str = INDEX_DIR) -> IndexSnapshot:
+    """Serve a just-saved snapshot's chunks from the saved (memory-mapped) files.
+
+    Incremental updates rebuild the chunk store in the heap; swapping it for the saved
+    copy puts the text back in the shared page cache. If another worker has saved over
+    index_dir meanwhile, the heap copy is kept.
+    """
+    if manifest is None or snapshot.chunks.is_mapped():
+        return snapshot
+    index_path = Path(index_dir)
+    try:
+        # Open the files before checking the manifest, so a later swap cannot go unnoticed
+        chunks = type(snapshot.chunks).load(index_path)
+        saved = json.loads((index_path / "manifest.json").read_text(encoding="utf-8"))
+    except Exception as e:
+        print(f"Error mapping saved chunks from {index_dir}: {e}")
+        return snapshot
+    if saved.get("version") != manifest["version"]:
+        return snapshot
+    return snapshot._replace(chunks=chunks)
+
+def _load_persisted_index(data_dir: str, index_dir: str = INDEX_DIR, check_sources: bool = True,
+                          store_sources: Optional[Dict[str, Dict[str, Any]]] = None) -> Optional[IndexSnapshot]:
+    """Load the saved index if it was built from the current source files.
+
+    Given store_sources (the corpus database's fingerprints), the index must instead have
+    been fitted on exactly those stored documents. Artifacts are loaded with
+    check_sources=False: the sources need not be present, but every file must match the
+    hash recorded in the manifest.
+    """
+    index_path = Path(index_dir)
+    manifest_path = index_path / "manifest.json"
+    if not manifest_path.exists():
+        return None
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        if manifest.get("format_version") != INDEX_FORMAT_VERSION:
+            return None
+        params = manifest["vectorizer"]
+        hashed = params.get("hash_features") is not None
+        # An artifact carries its own settings; a cache must match this process's settings
+        if check_sources and params != _vectorizer_config(STREAMING_BUILD):
+            return None
+        from_store = manifest.get("chunk_store") == "database"
+        if check_sources and from_store != (store_sources is not None):
+            return None
+        if check_sources and from_store and manifest["sources"] != store_sources:
+            return None
+        if check_sources and not from_store and not _manifest_is_current(manifest["sources"], _source_files(Path(data_dir))):
+            return None
+        if not check_sources:
+            for name, digest in manifest["files"].items():
+                if _hash_file(index_path / name) != digest:
+                    raise ValueError(f"{name} does not match the manifest hash")
+
+        documents = json.loads((index_path / "documents.json").read_text(encoding="utf-8"))
+        chunks = CorpusChunkStore.load(index_path) if from_store else ChunkStore.load(index_path)
+        if hashed:
+            vectorizer = HashedTfidfVectorizer(params["hash_features"], np.load(index_path / "idf.npy"))
+        else:
+            vocabulary = json.loads((index_path / "vocabulary.json").read_text(encoding="utf-8"))
+            vectorizer = TfidfVectorizer(
+                stop_words=params["stop_words"],
+                ngram_range=tuple(params["ngram_range"]),
+                vocabulary=vocabulary
+            )
+            vectorizer.idf_ = np.load(index_path / "idf.npy")
+        tfidf_matrix = sparse.load_npz(index_path / "tfidf_matrix.npz").tocsr()
+        intent_rows, intent_matrix = _intent_vectors(vectorizer)
+        intent_matrix = _compact(intent_matrix)
+        
+        # Dense LSA vectors stay on disk; worker processes share them through the page cache
+        components = vectors = None
+        if (index_path / "lsa_components.npy").exists():
+            components = np.load(index_path / "lsa_components.npy", mmap_mode="r")
+            vectors = np.load(index_path / "lsa_vectors.npy", mmap_mode="r")
+        
+        if hashed:
+            bm25_vectorizer = vectorizer.hasher
+        else:
+            bm25_vectorizer = _with_term_table(CountVectorizer(**BM25_VECTORIZER_PARAMS), TermTable.load(index_path, "bm25"))
+        bm25_rows = np.load(index_path / "bm25_rows.npy", mmap_mode="r") if (index_path / "bm25_rows.npy").exists() else None
+        bm25 = _make_bm25_index(bm25_vectorizer, sparse.load_npz(index_path / "bm25_postings.npz").tocsc(),
+                                np.load(index_path / "bm25_idf.npy"), manifest["bm25_avgdl"], bm25_rows)
+    except Exception as e:
+        print(f"Error loading document index from {index_dir}: {e}")
+        return None
+    return IndexSnapshot(documents, chunks, vectorizer, tfidf_matrix, intent_rows, intent_matrix,
+                         components, vectors, bm25, manifest["sources"], manifest.get("delta_chunks", 0),
+                         manifest.get("duplicates"))
+
+def _stream_fit(texts: Iterable[str]):
+    """Hash texts batch by batch, accumulating document frequencies as they go.
+
+    Only one batch of text is vectorized at a time; returns (vectorizer, L2-normalized
+    TF-IDF matrix, BM25 index), or (None, None, None) if there were no texts. BM25 is
+    weighted from the same hashed counts, so no vocabulary is ever built.
+    """
+    vectorizer = HashedTfidfVectorizer()
+    df = np.zeros(vectorizer.n_features, dtype=np.int64)
+    segments = []
+    texts = iter(texts)
+    while True:
+        batch = list(islice(texts, STREAM_BATCH_CHUNKS))
+        if not batch:
+            break
+        counts = vectorizer.counts(batch)
+        df += np.bincount(counts.indices, minlength=vectorizer.n_features)
+        segments.append(counts)
+    
+    n_rows = sum(segment.shape[0] for segment in segments)
+    if n_rows == 0:
+        return None, None, None
+    counts = sparse.vstack(segments, format="csr")
+    del segments[:]
+    bm25 = _bm25_fit(vectorizer.hasher, counts)
+    # Same smoothed idf as TfidfVectorizer
+    vectorizer.idf_ = (np.log((1 + n_rows) / (1 + df)) + 1).astype(np.float32)
+    tfidf_matrix = normalize(counts @ sparse.diags(vectorizer.idf_))
+    return vectorizer, tfidf_matrix.tocsr(), bm25
+
+def _fit_chunks(chunks: List[Dict[str, Any]], hashed: bool = None,
+                vectorizer_params: Optional[Dict[str, Any]] = None, texts: Optional[Iterable[str]] = None):
+    """Fit a fresh vectorizer over existing chunks; returns (vectorizer, matrix, BM25 index).
+
+    The BM25 index is None unless hashed: a vocabulary-based one is built by _complete_snapshot.
+    texts, if given, is the chunks' text in order, read by the caller.
+    """
+    if hashed is None:
+        hashed = STREAMING_BUILD
+    if not chunks:
+        return None, None, None
+    if texts is None:
+        # Stores hand out text in bulk rather than one item at a time
+        texts = chunks.texts() if hasattr(chunks, "texts") else (chunk["text"] for chunk in chunks)
+    if hashed:
+        return _stream_fit(texts)
+    vectorizer = TfidfVectorizer(**(vectorizer_params or VECTORIZER_PARAMS), dtype=np.float32)
+    tfidf_matrix = vectorizer.fit_transform(texts)
+    # Every term cut by max_features ends up here; it is only for introspection
+    vectorizer.stop_words_ = None
+    return vectorizer, tfidf_matrix, None
+
+def build_index_snapshot(documents: List[Dict[str, Any]],
+                         manifest: Optional[Dict[str, Dict[str, Any]]] = None,
+                         duplicates: Optional[Dict[str, List[Dict[str, str]]]] = None,
+                         vectorizer_params: Optional[Dict[str, Any]] = None,
+                         timings: Optional[Dict[str, float]] = None,
+                         lsa: Optional[bool] = None) -> IndexSnapshot:
+    """Fit a complete index over documents without touching the shared index.
+
+    duplicates carries documents already dropped at ingest; near-duplicate chunks are added to it.
+    vectorizer_params overrides VECTORIZER_PARAMS for offline tuning; such an index is not
+    meant to be persisted. timings, if given, receives the seconds spent on each structure
+    ("chunking", "tfidf", "intent", "lsa", "bm25"). lsa overrides LSA_ENABLED.
+    """
+    duplicates = duplicates if duplicates is not None else {"documents": [], "chunks": []}
+    if timings is None:
+        timings = {}
+    start = time.perf_counter()
+    chunks = build_chunks(documents, duplicates)
+    timings["chunking"] = time.perf_counter() - start
+    start = time.perf_counter()
+    vectorizer, tfidf_matrix, bm25 = _fit_chunks(chunks, vectorizer_params=vectorizer_params)
+    timings["tfidf"] = time.perf_counter() - start
+    _report_duplicates(duplicates)
+    return _complete_snapshot(documents, chunks, vectorizer, tfidf_matrix, manifest, duplicates=duplicates,
+                              bm25=bm25, timings=timings, lsa=lsa)
+
+def build_index_snapshot_streaming(files: List[Path],
+                                   manifest: Optional[Dict[str, Dict[str, Any]]] = None) -> IndexSnapshot:
+    """Build a hashed-feature index reading, chunking and vectorizing one document at a time.
+
+    Documents keep only title and path; their text lives on in the chunks. Near-duplicate
+    documents and chunks are dropped as they stream past. Files that fail to parse are
+    left out of the manifest, so the next refresh retries them.
+    """
     documents = []
+    failed = []
+    chunks = _ChunkStoreWriter()
+    duplicates = {"documents": [], "chunks": []}
+    document_filter, chunk_filter = NearDuplicateFilter(), NearDuplicateFilter()
+    
+    def chunk_texts() -> Iterator[str]:
+        for file_path, content in zip(files, iter_documents_parallel([str(p) for p in files], failed=failed)):
+            if not content.strip():
+                continue
+            original = document_filter.add(str(file_path), content)
+            if original is not None:
+                duplicates["documents"].append({"path": str(file_path), "duplicate_of": original})
+                continue
+            documents.append({"title": file_path.stem, "path": str(file_path)})
+            for text in chunk_document(content):
+                original = chunk_filter.add(str(file_path), text)
+                if original is not None:
+                    duplicates["chunks"].append({"path": str(file_path), "duplicate_of": original})
+                    continue
+                chunks.append(len(documents) - 1, text)
+                yield text
+    
+    vectorizer, tfidf_matrix, bm25 = _stream_fit(chunk_texts())
+    _report_duplicates(duplicates)
+    if manifest is not None:
+        manifest = {key: value for key, value in manifest.items() if key not in failed}
+    return _complete_snapshot(documents, chunks.finish(), vectorizer, tfidf_matrix, manifest,
+                              duplicates=duplicates, bm25=bm25)
+
+def _ingest_sources(data_path: Path):
+    """Parse every source file in data_path, collapsing near-duplicate documents.
+
+    Returns (documents, source manifest, duplicates report). Files that fail to parse are
+    left out of the manifest, so the next refresh retries them.
+    """
+    documents = []
+    duplicates = {"documents": [], "chunks": []}
+    document_filter = NearDuplicateFilter()
+    files = _source_files(data_path)
+    failed = []
+    for file_path, content in zip(files, iter_documents_parallel([str(p) for p in files], failed=failed)):
+        if not content.strip():
+            continue
+        original = document_filter.add(str(file_path), content)
+        if original is not None:
+            duplicates["documents"].append({"path": str(file_path), "duplicate_of": original})
+            continue
+        documents.append({
+            "title": file_path.stem,
+            "content": content,
+            "path": str(file_path)
+        })
+    failed = set(failed)
+    return documents, _build_manifest([p for p in files if str(p) not in failed]), duplicates
+
+def read_source_documents(data_dir: str = DATA_DIR) -> List[Dict[str, Any]]:
+    """Parse the source files in data_dir into documents (near-duplicates collapsed), without indexing"""
+    return _ingest_sources(Path(data_dir))[0]
+
+def build_index_from_directory(data_dir: str, streaming: bool = None) -> IndexSnapshot:
+    """Ingest every source file in data_dir and fit a new index, without touching the shared one"""
+    if streaming is None:
+        streaming = STREAMING_BUILD
     data_path = Path(data_dir)
+    if streaming:
+        files = _source_files(data_path)
+        return build_index_snapshot_streaming(files, _build_manifest(files))
+    return build_index_snapshot(*_ingest_sources(data_path))
+
+def _corpus_db():
+    """The corpus database helpers, imported on first use since importing them creates the app database"""
+    import db_utils
+    return db_utils
+
+def _store_manifest(stored: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Source fingerprints of the documents in the corpus database"""
+    return {doc["path"]: {key: doc[key] for key in ("mtime_ns", "size", "sha256")} for doc in stored}
+
+def sync_corpus_store(data_dir: str = DATA_DIR, files: Optional[List[Path]] = None) -> Dict[str, List[str]]:
+    """Write new and changed source files (chunked) into the corpus database and drop deleted ones.
+
+    Files whose stored fingerprint is still current are not reread, so each version of a
+    file is parsed once however many workers start. Given files, only those are synced.
+    """
+    db = _corpus_db()
+    stored = {doc["path"]: doc for doc in db.load_corpus_documents()}
+    changes = {"added": [], "updated": [], "removed": []}
+    if files is None:
+        files = _source_files(Path(data_dir))
+        present = {str(p) for p in files}
+        for path_key in stored:
+            if path_key not in present and db.delete_corpus_document(path_key):
+                changes["removed"].append(path_key)
+    
+    stale = [p for p in files if str(p) not in stored or not _file_is_current(stored[str(p)], p)]
+    failed = []
+    for file_path, content in zip(stale, iter_documents_parallel([str(p) for p in stale], failed=failed)):
+        path_key = str(file_path)
+        if path_key in failed:
+            # Left as it was, so the next sync tries again
+            continue
+        chunks = chunk_document(content) if content.strip() else []
+        if db.save_corpus_document(path_key, file_path.stem, _build_manifest([file_path])[path_key], chunks) is not None:
+            changes["updated" if path_key in stored else "added"].append(path_key)
+    return changes
+
+def build_index_from_store() -> IndexSnapshot:
+    """Fit an index over the chunks in the corpus database without reading any source file.
+
+    The snapshot holds chunk ids rather than text (see CorpusChunkStore). Near-duplicate
+    chunks are dropped as they are read, so a document made only of duplicates is left out.
+    """
+    db = _corpus_db()
+    stored = db.load_corpus_documents()
+    by_id = {doc["id"]: doc for doc in stored}
+    documents, positions = [], {}
+    ids, doc_ids = array("q"), array("i")
+    duplicates = {"documents": [], "chunks": []}
+    chunk_filter = NearDuplicateFilter()
+    for chunk_id, document_id, text in db.iter_corpus_chunks():
+        doc = by_id.get(document_id)
+        if doc is None:
+            # Ingested after the document list was read
+            continue
+        original = chunk_filter.add(doc["path"], text)
+        if original is not None:
+            duplicates["chunks"].append({"path": doc["path"], "duplicate_of": original})
+            continue
+        if document_id not in positions:
+            positions[document_id] = len(documents)
+            documents.append({"title": doc["title"], "path": doc["path"]})
+        ids.append(chunk_id)
+        doc_ids.append(positions[document_id])
+    
+    chunks = CorpusChunkStore(np.frombuffer(ids, dtype=np.int64), np.frombuffer(doc_ids, dtype=np.int32))
+    vectorizer, tfidf_matrix, bm25 = _fit_chunks(chunks)
+    _report_duplicates(duplicates)
+    return _complete_snapshot(documents, chunks, vectorizer, tfidf_matrix, _store_manifest(stored),
+                              duplicates=duplicates, bm25=bm25)
+
+def _snapshot_from_store(data_dir: str) -> IndexSnapshot:
+    """Sync data_dir into the corpus database, then load the index saved for its contents or fit one"""
+    db = _corpus_db()
+    if Path(data_dir).exists():
+        sync_corpus_store(data_dir)
+    # Read before the documents: a change in between only costs one extra catch-up
+    _index.corpus_version = db.get_corpus_version()
+    _index.checked_at = time.monotonic()
+    snapshot = _load_persisted_index(data_dir, store_sources=_store_manifest(db.load_corpus_documents()))
+    if snapshot is None:
+        snapshot = build_index_from_store()
+        if snapshot.vectorizer is not None:
+            snapshot = _remap_chunks(snapshot, _save_persisted_index(snapshot))
+    return snapshot
+
+def _apply_store_documents(snapshot: IndexSnapshot, stored: List[Dict[str, Any]]):
+    """Bring a store-backed snapshot in line with the stored documents, one document at a time.
+
+    Returns (snapshot, changes); documents whose fingerprint matches are left alone.
+    """
+    db = _corpus_db()
+    sources = _store_manifest(stored)
+    manifest = snapshot.manifest or {}
+    changes = {"added": [], "updated": [], "removed": []}
+    for path_key in manifest:
+        if path_key not in sources:
+            snapshot = _drop_document(snapshot, path_key)
+            changes["removed"].append(path_key)
+    for doc in stored:
+        path_key = doc["path"]
+        if manifest.get(path_key) == sources[path_key]:
+            continue
+        rows = db.load_corpus_chunks(doc["id"])
+        snapshot = _replace_document(snapshot, path_key, doc["title"], [text for _, text in rows],
+                                     sources[path_key], chunk_ids=[chunk_id for chunk_id, _ in rows])
+        changes["updated" if path_key in manifest else "added"].append(path_key)
+    return snapshot, changes
+
+def _sync_with_store(data_dir: str = DATA_DIR, persist: bool = True) -> Dict[str, List[str]]:
+    """Apply corpus database changes (from this worker or any other) to the shared index"""
+    if _index.peek() is None:
+        _index.get(data_dir)
+    db = _corpus_db()
+    with _index.build_lock:
+        current = _index.peek()
+        version = db.get_corpus_version()
+        snapshot, changes = _apply_store_documents(current, db.load_corpus_documents())
+        if snapshot is not current:
+            _index.publish(snapshot, persist=persist)
+        _index.corpus_version = version
+        _index.checked_at = time.monotonic()
+    _index.flush()
+    _schedule_refit_if_needed(snapshot)
+    return changes
+
+def _poll_corpus_store() -> None:
+    """Catch up with other workers' corpus changes, checking the version at most every CORPUS_POLL_SECONDS"""
+    if time.monotonic() - _index.checked_at < CORPUS_POLL_SECONDS:
+        return
+    # Whoever holds the lock is already updating the index; keep serving meanwhile
+    if not _index.build_lock.acquire(blocking=False):
+        return
+    try:
+        _index.checked_at = time.monotonic()
+        if _corpus_db().get_corpus_version() != _index.corpus_version:
+            # Every worker catches up on its own; whoever wrote the change saved the index
+            _sync_with_store(persist=False)
+    except Exception as e:
+        print(f"Error checking the corpus database for changes: {e}")
+    finally:
+        _index.build_lock.release()
+
+def _snapshot_from_sources(data_dir: str) -> IndexSnapshot:
+    """Load the artifact, the corpus database or a current persisted index, otherwise ingest data_dir"""
+    if ARTIFACT_DIR:
+        snapshot = _load_persisted_index(data_dir, ARTIFACT_DIR, check_sources=False)
+        if snapshot is None:
+            # Serving an empty index would look healthy; fail warm-up instead
+            raise RuntimeError(f"Retrieval artifact {ARTIFACT_DIR} is missing, corrupt or from another index format")
+        return snapshot
     
+    data_path = Path(data_dir)
+    if CORPUS_STORE == "sqlite":
+        return _snapshot_from_store(data_dir)
     if not data_path.exists():
-        return documents
+        return build_index_snapshot([])
     
-    for file_path in data_path.glob("*"):
-        if file_path.suffix in ['.pdf', '.docx', '.txt']:
-            content = load_document(str(file_path))
-            if content.strip():
-                documents.append({
-                    "title": file_path.stem,
-                    "content": content,
-                    "path": str(file_path)
-                })
+    persisted = _load_persisted_index(data_dir)
+    if persisted is not None:
+        return persisted
     
-    _documents_cache = documents
-    return documents
+    snapshot = build_index_from_directory(data_dir)
+    if snapshot.vectorizer is not None:
+        # Persist the fitted index so the next process start can skip ingestion
+        snapshot = _remap_chunks(snapshot, _save_persisted_index(snapshot))
+    return snapshot
 
-def build_document_index(documents: List[Dict[str, Any]]):
-    """Build TF-IDF index for semantic search"""
-    global _vectorizer_cache, _tfidf_matrix_cache
+class _IndexHolder:
+    """Owns the shared IndexSnapshot.
+
+    Readers take the current snapshot without locking. Builds and updates run one at a
+    time under build_lock and publish a finished snapshot with a single reference swap,
+    so a half-built index is never visible and no two threads build the same index.
+    Only the very first build makes callers wait; after that they keep serving the old
+    snapshot until the new one is swapped in. Saving to disk happens in flush(), after
+    the build lock is released. A store-backed index also checks the corpus database's
+    version now and then and catches up with other workers' changes.
+    """
     
-    if _vectorizer_cache is not None and _tfidf_matrix_cache is not None:
-        return _vectorizer_cache, _tfidf_matrix_cache
+    def __init__(self):
+        self._snapshot = None
+        self.build_lock = threading.RLock()
+        self._unsaved = None  # Latest published snapshot still to be written by flush()
+        self._save_lock = threading.Lock()
+        self.corpus_version = None  # Corpus database version the snapshot reflects
+        self.checked_at = 0.0
     
-    if not documents:
-        return None, None
+    def peek(self) -> Optional[IndexSnapshot]:
+        return self._snapshot
     
-    # Create TF-IDF vectorizer
-    vectorizer = TfidfVectorizer(
-        max_features=1000,
-        stop_words='english',
-        ngram_range=(1, 2)
-    )
+    def get(self, data_dir: str = DATA_DIR) -> IndexSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self.build_lock:
+                # Single flight: threads that queued behind the builder find its result
+                snapshot = self._snapshot
+                if snapshot is None:
+                    snapshot = _snapshot_from_sources(data_dir)
+                    self.publish(snapshot, persist=False)
+        elif CORPUS_STORE == "sqlite" and not ARTIFACT_DIR:
+            _poll_corpus_store()
+            snapshot = self._snapshot
+        return snapshot
     
-    # Build document corpus
-    corpus = [doc["content"] for doc in documents]
-    tfidf_matrix = vectorizer.fit_transform(corpus)
+    def publish(self, snapshot: IndexSnapshot, expected: Optional[IndexSnapshot] = None,
+                persist: bool = True) -> bool:
+        """Swap in a new snapshot (only if `expected` is still current, when given).
+
+        With persist, the snapshot is queued for the next flush() rather than written
+        while the caller holds the build lock.
+        """
+        with self.build_lock:
+            if expected is not None and self._snapshot is not expected:
+                return False
+            self._snapshot = snapshot
+            _invalidate_context_cache()
+            if persist and not ARTIFACT_DIR and snapshot.vectorizer is not None and snapshot.manifest is not None:
+                self._unsaved = snapshot
+            return True
     
-    _vectorizer_cache = vectorizer
-    _tfidf_matrix_cache = tfidf_matrix
+    def flush(self) -> None:
+        """Write the latest published snapshot to disk, unless a flush already has.
+
+        Call it without holding the build lock: readers and updates carry on meanwhile,
+        and a burst of updates costs one save per flush rather than one per change.
+        """
+        with self._save_lock:
+            snapshot, self._unsaved = self._unsaved, None
+            if snapshot is None:
+                return
+            mapped = _remap_chunks(snapshot, _save_persisted_index(snapshot))
+            if mapped is not snapshot:
+                with self.build_lock:
+                    # Same index, so cached results stay valid
+                    if self._snapshot is snapshot:
+                        self._snapshot = mapped
+
+_index = _IndexHolder()
+
+def build_artifact(out_dir: str, data_dir: str = DATA_DIR, cards_path: str = CARDS_PATH,
+                   streaming: bool = None) -> Dict[str, Any]:
+    """Ingest sources and skill cards from scratch and write a self-contained retrieval artifact"""
+    if not Path(data_dir).exists():
+        raise FileNotFoundError(f"Data directory not found: {data_dir}")
+    snapshot = build_index_from_directory(data_dir, streaming)
+    if snapshot.vectorizer is None:
+        raise ValueError(f"No indexable documents in {data_dir}")
     
-    return vectorizer, tfidf_matrix
+    cards = json.loads(Path(cards_path).read_text(encoding="utf-8"))
+    manifest = _save_persisted_index(snapshot, out_dir, cards=cards, cards_source=_build_manifest([Path(cards_path)]))
+    if manifest is None:
+        raise OSError(f"Could not write artifact to {out_dir}")
+    return manifest
 
-def search_documents(query: str, intent: str = None, k: int = 3) -> List[Dict[str, Any]]:
-    """Search documents using semantic similarity"""
-    documents = load_all_documents()
+def _load_artifact_cards(artifact_dir: str) -> List[Dict[str, Any]]:
+    """Load skill cards and their prebuilt tag index from an artifact"""
+    global _card_index_cache
+    artifact_path = Path(artifact_dir)
+    cards = json.loads((artifact_path / "cards.json").read_text(encoding="utf-8"))
+    card_tags = json.loads((artifact_path / "card_tags.json").read_text(encoding="utf-8"))
+    _card_index_cache = (cards, MappingProxyType({tag: tuple(positions) for tag, positions in card_tags.items()}))
+    _invalidate_context_cache()
+    return cards
+
+def set_index(snapshot: IndexSnapshot) -> None:
+    """Serve this snapshot as the shared index (for offline tools and benchmarks; not persisted)"""
+    _index.publish(snapshot, persist=False)
+
+def duplicate_report() -> Dict[str, List[Dict[str, str]]]:
+    """Near-duplicate documents and chunks dropped when the shared index was built"""
+    return _index.get().duplicates or {"documents": [], "chunks": []}
+
+def load_all_documents(data_dir: str = DATA_DIR) -> List[Dict[str, Any]]:
+    """Load all documents from the data directory, reusing the persisted index when it is current"""
+    return _index.get(data_dir).documents
+
+def build_document_index(documents: List[Dict[str, Any]]):
+    """Return the shared TF-IDF index, fitting it over these documents if none exists yet"""
+    snapshot = _index.peek()
+    if snapshot is None:
+        with _index.build_lock:
+            snapshot = _index.peek()
+            if snapshot is None:
+                snapshot = build_index_snapshot(documents)
+                _index.publish(snapshot, persist=False)
+    return snapshot.vectorizer, snapshot.tfidf_matrix
+
+def _without_document(snapshot: IndexSnapshot, path_key: str):
+    """Return (documents, chunks, matrix, bm25) with one document dropped, renumbering later doc ids"""
+    documents = snapshot.documents
+    doc_id = next((i for i, doc in enumerate(documents) if doc["path"] == path_key), None)
+    if doc_id is None:
+        return documents, snapshot.chunks, snapshot.tfidf_matrix, snapshot.bm25
     
-    if not documents:
-        return []
+    doc_ids = np.asarray(snapshot.chunks.doc_ids)
+    keep = doc_ids != doc_id
+    chunks = snapshot.chunks.select(keep, doc_ids[keep] - (doc_ids[keep] > doc_id))
+    tfidf_matrix = snapshot.tfidf_matrix[keep] if snapshot.tfidf_matrix is not None else None
+    bm25 = _bm25_without(snapshot.bm25, keep) if snapshot.bm25 is not None else None
+    return documents[:doc_id] + documents[doc_id + 1:], chunks, tfidf_matrix, bm25
+
+def _schedule_refit_if_needed(snapshot: IndexSnapshot) -> None:
+    """Start a background full refit once the delta is large, unless one is already running"""
+    global _refit_thread
+    if snapshot.delta_chunks <= REFIT_DELTA_RATIO * max(len(snapshot.chunks), 1):
+        return
+    with _refit_lock:
+        if _refit_thread is not None and _refit_thread.is_alive():
+            return
+        _refit_thread = threading.Thread(target=_refit_index, name="rag-refit", daemon=True)
+        _refit_thread.start()
+
+def _count_empty(texts: Iterable[str], empty: List[int]) -> Iterator[str]:
+    """Pass texts through, appending the position of each empty one to empty"""
+    for i, text in enumerate(texts):
+        if not text:
+            empty.append(i)
+        yield text
+
+def _refit_index() -> None:
+    """Refit the vectorizer on the current chunks and swap the result in.
+
+    A store-backed snapshot reads its text from the corpus database without the build
+    lock, so another worker may have deleted some chunks meanwhile (they read as empty).
+    Such a fit is dropped and the index is marked for catch-up, which schedules the
+    refit again.
+    """
+    try:
+        while True:
+            current = _index.peek()
+            if current is None or not current.chunks:
+                return
+            hashed = isinstance(current.vectorizer, HashedTfidfVectorizer)
+            empty = []
+            try:
+                vectorizer, tfidf_matrix, bm25 = _fit_chunks(current.chunks, hashed,
+                                                             texts=_count_empty(current.chunks.texts(), empty))
+            except ValueError:
+                # Every chunk read as empty: the vocabulary is empty too
+                if not empty:
+                    raise
+            if empty:
+                if _index.peek() is current:
+                    _index.checked_at = 0.0
+                    return
+                continue
+            fresh = _complete_snapshot(current.documents, current.chunks, vectorizer, tfidf_matrix,
+                                       current.manifest, previous=current, bm25=bm25)
+            # Documents changed while fitting - refit again rather than publish a stale index
+            if _index.publish(fresh, expected=current):
+                _index.flush()
+                return
+    except Exception as e:
+        print(f"Error refitting document index: {e}")
+
+def _replace_document(snapshot: IndexSnapshot, path_key: str, title: str, texts: List[str],
+                      fingerprint: Dict[str, Any], chunk_ids: Optional[List[int]] = None) -> IndexSnapshot:
+    """Return a snapshot with one document's chunks replaced (or added) without refitting.
+
+    chunk_ids are the texts' corpus database ids, for a store-backed index. A document
+    without text keeps only its manifest entry, like an empty file at ingest.
+    """
+    documents, chunks, tfidf_matrix, bm25 = _without_document(snapshot, path_key)
+    manifest = {**(snapshot.manifest or {}), path_key: fingerprint}
+    removed = len(snapshot.chunks) - len(chunks)
+    first_position = len(chunks)
+    if texts:
+        documents = documents + [{"title": title, "path": path_key}]
+        chunks = chunks.extend(len(documents) - 1, texts if chunk_ids is None else chunk_ids)
     
-    vectorizer, tfidf_matrix = build_document_index(documents)
+    if snapshot.vectorizer is None:
+        # Nothing to extend yet - fit from scratch
+        vectorizer, tfidf_matrix, bm25 = _fit_chunks(chunks)
+        return _complete_snapshot(documents, chunks, vectorizer, tfidf_matrix, manifest, bm25=bm25,
+                                  duplicates=snapshot.duplicates)
+    if texts:
+        # Terms the fitted vocabularies have not seen are picked up by the next refit
+        tfidf_matrix = sparse.vstack([tfidf_matrix, snapshot.vectorizer.transform(texts)], format="csr")
+        bm25 = _bm25_append(bm25, texts, first_position)
+    return _complete_snapshot(documents, chunks, snapshot.vectorizer, tfidf_matrix, manifest,
+                              delta_chunks=snapshot.delta_chunks + removed + len(texts),
+                              previous=snapshot, bm25=bm25)
+
+def _drop_document(snapshot: IndexSnapshot, path_key: str) -> IndexSnapshot:
+    """Return a snapshot without one document's chunks and manifest entry"""
+    documents, chunks, tfidf_matrix, bm25 = _without_document(snapshot, path_key)
+    manifest = {key: value for key, value in (snapshot.manifest or {}).items() if key != path_key}
+    return _complete_snapshot(documents, chunks, snapshot.vectorizer, tfidf_matrix, manifest,
+                              delta_chunks=snapshot.delta_chunks + len(snapshot.chunks) - len(chunks),
+                              previous=snapshot, bm25=bm25)
+
+def _has_document(snapshot: IndexSnapshot, path_key: str) -> bool:
+    """True if the snapshot indexes the file or lists it in its manifest"""
+    return path_key in (snapshot.manifest or {}) or any(doc["path"] == path_key for doc in snapshot.documents)
+
+def _apply_file(snapshot: IndexSnapshot, path: Path, texts: Optional[List[str]]) -> IndexSnapshot:
+    """Return a snapshot with one file's chunks applied; None texts (unreadable) drops the file.
+
+    An unreadable file leaves the manifest, so the next refresh retries it; an emptied
+    file keeps its manifest entry but should not keep serving its old chunks.
+    """
+    path_key = str(path)
+    if texts is None:
+        return _drop_document(snapshot, path_key) if _has_document(snapshot, path_key) else snapshot
+    return _replace_document(snapshot, path_key, path.stem, texts, _build_manifest([path])[path_key])
+
+def _file_chunks(content: str) -> List[str]:
+    """Chunks of a file's text; none for an empty file"""
+    return chunk_document(content) if content.strip() else []
+
+def add_document(file_path: str, data_dir: str = DATA_DIR) -> bool:
+    """Add (or replace) one document in the index without refitting the vectorizer"""
+    path = Path(file_path)
+    if CORPUS_STORE == "sqlite":
+        changes = sync_corpus_store(data_dir, [path])
+        _sync_with_store(data_dir)
+        return bool(changes["added"] or changes["updated"])
     
-    if vectorizer is None:
-        return []
+    try:
+        texts = _file_chunks(_read_document(str(path)))
+    except Exception as e:
+        print(f"Error loading {path}: {e}")
+        texts = None
     
-    # Expand query with related terms based on intent
-    intent_keywords = {
-        "stress": "stress anxiety worried nervous pressure overwhelmed",
-        "test_anxiety": "test exam study school grade performance academic",
-        "social_anxiety": "social friends peer judgment embarrassed shy awkward",
-        "sadness": "sad depressed down lonely isolated unhappy",
-        "anger": "angry mad frustrated annoyed irritated",
-        "loneliness": "lonely alone isolated friendless disconnected",
-        "grief": "grief loss death dying mourning sad",
-        "panic": "panic attack fear terror heart racing breathing",
-        "overwhelmed": "overwhelmed too much can't cope drowning pressure",
-        "fear": "scared afraid frightened worried anxious nervous",
-        "worry": "worried worrying anxious concern stress",
-        "frustration": "frustrated annoyed irritated stuck blocked",
-        "tired": "tired exhausted fatigue drained sleep rest",
-        "bored": "bored boring nothing dull uninterested",
-        "self_harm": "self harm cutting hurt injury pain",
-        "crisis": "crisis emergency danger help now urgent"
+    with _index.build_lock:
+        current = _index.get(data_dir)
+        snapshot = _apply_file(current, path, texts)
+        if snapshot is not current:
+            _index.publish(snapshot)
+    _index.flush()
+    _schedule_refit_if_needed(snapshot)
+    return bool(texts)
+
+def remove_document(file_path: str, data_dir: str = DATA_DIR) -> bool:
+    """Remove one document and its chunks from the index.
+
+    Files indexed without chunks (empty, or near-duplicates of another file) have only a
+    manifest entry; it is dropped all the same, so the saved index stays current.
+    """
+    if CORPUS_STORE == "sqlite":
+        removed = _corpus_db().delete_corpus_document(str(Path(file_path)))
+        _sync_with_store(data_dir)
+        return removed
+    
+    with _index.build_lock:
+        current = _index.get(data_dir)
+        path_key = str(Path(file_path))
+        if not _has_document(current, path_key):
+            return False
+        snapshot = _drop_document(current, path_key)
+        _index.publish(snapshot)
+    _index.flush()
+    _schedule_refit_if_needed(snapshot)
+    return True
+
+def refresh_changed(data_dir: str = DATA_DIR) -> Dict[str, List[str]]:
+    """Apply added, modified and deleted files in data_dir to the index incrementally.
+
+    Changed files are read first, then every change is applied to one snapshot that is
+    published and saved once.
+    """
+    if CORPUS_STORE == "sqlite":
+        changes = sync_corpus_store(data_dir)
+        _sync_with_store(data_dir)
+        return changes
+    
+    manifest = dict(_index.get(data_dir).manifest or {})
+    files = {str(p): p for p in _source_files(Path(data_dir))}
+    changes = {"added": [], "updated": [], "removed": []}
+    changes["removed"] = [path_key for path_key in manifest if path_key not in files]
+    for path_key, file_path in files.items():
+        if path_key not in manifest:
+            changes["added"].append(path_key)
+        elif not _file_is_current(manifest[path_key], file_path):
+            changes["updated"].append(path_key)
+    if not any(changes.values()):
+        return changes
+    
+    stale = changes["added"] + changes["updated"]
+    failed = []
+    contents = list(iter_documents_parallel(stale, failed=failed))
+    with _index.build_lock:
+        snapshot = current = _index.get(data_dir)
+        for path_key in changes["removed"]:
+            if _has_document(snapshot, path_key):
+                snapshot = _drop_document(snapshot, path_key)
+        for path_key, content in zip(stale, contents):
+            texts = None if path_key in failed else _file_chunks(content)
+            snapshot = _apply_file(snapshot, files[path_key], texts)
+        if snapshot is not current:
+            _index.publish(snapshot)
+    _index.flush()
+    _schedule_refit_if_needed(snapshot)
+    return changes
+
+# Expansion terms appended to a query for each intent
+INTENT_KEYWORDS = {
+    "stress": "stress anxiety worried nervous pressure overwhelmed",
+    "test_anxiety": "test exam study school grade performance academic",
+    "social_anxiety": "social friends peer judgment embarrassed shy awkward",
+    "sadness": "sad depressed down lonely isolated unhappy",
+    "anger": "angry mad frustrated annoyed irritated",
+    "loneliness": "lonely alone isolated friendless disconnected",
+    "grief": "grief loss death dying mourning sad",
+    "panic": "panic attack fear terror heart racing breathing",
+    "overwhelmed": "overwhelmed too much can't cope drowning pressure",
+    "fear": "scared afraid frightened worried anxious nervous",
+    "worry": "worried worrying anxious concern stress",
+    "frustration": "frustrated annoyed irritated stuck blocked",
+    "tired": "tired exhausted fatigue drained sleep rest",
+    "bored": "bored boring nothing dull uninterested",
+    "self_harm": "self harm cutting hurt injury pain",
+    "crisis": "crisis emergency danger help now urgent"
+}
+
+# Weight of the intent expansion vector relative to the query vector
+INTENT_EXPANSION_WEIGHT = float(os.getenv("RAG_INTENT_WEIGHT", "1.0"))
+
+# Chunks scoring at or below this cosine similarity are never returned
+MIN_SIMILARITY = 0.03  # Lower threshold to include more relevant docs
+
+# Ranking modes: "tfidf" scores the sparse chunk matrix, "lsa" scores dense SVD projections,
+# "bm25" walks the postings of the query terms only
+RANKERS = ("tfidf", "lsa", "bm25")
+# "fts" ranks with SQLite FTS5 bm25() over the corpus database (RAG_CORPUS_STORE=sqlite only)
+CORPUS_RANKERS = ("fts",)
+FTS_CANDIDATES = 200
+DEFAULT_RANKER = os.getenv("RAG_RANKER", "tfidf")
+# The SVD is fitted only when LSA is served; otherwise "lsa" queries rank with TF-IDF
+LSA_ENABLED = os.getenv("RAG_LSA", "1" if DEFAULT_RANKER == "lsa" else "0") == "1"
+LSA_COMPONENTS = int(os.getenv("RAG_LSA_COMPONENTS", "256"))
+LSA_MIN_SIMILARITY = 0.2  # Dense cosines run higher than sparse ones
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# BM25 uses its own uncapped vocabulary with the same tokenization as the TF-IDF index
+BM25_VECTORIZER_PARAMS = {
+    "stop_words": VECTORIZER_PARAMS["stop_words"],
+    "ngram_range": VECTORIZER_PARAMS["ngram_range"],
+}
+EXCERPT_MAX_CHARS = 1200
+
+def _raw_tfidf(vectorizer, texts: List[str]):
+    """TF-IDF weights before L2 normalization, so vectors for separate texts can be added"""
+    if isinstance(vectorizer, HashedTfidfVectorizer):
+        counts = vectorizer.counts(texts)
+    else:
+        counts = CountVectorizer.transform(vectorizer, texts)
+    return (counts @ sparse.diags(vectorizer.idf_)).tocsr()
+
+def _intent_vectors(vectorizer):
+    """Return (intent -> row, matrix) of expansion vectors; computed once per fitted vectorizer"""
+    intents = list(INTENT_KEYWORDS)
+    rows = {intent: i for i, intent in enumerate(intents)}
+    return rows, _raw_tfidf(vectorizer, [INTENT_KEYWORDS[i] for i in intents])
+
+def _query_vectors(snapshot: IndexSnapshot, queries: List[str], intents: List[Optional[str]],
+                   weight: float = None):
+    """Vectorize queries and add each one's cached intent expansion vector.
+
+    With weight 1.0 this matches vectorizing the query with the intent terms appended.
+    """
+    if weight is None:
+        weight = INTENT_EXPANSION_WEIGHT
+    query_matrix = _raw_tfidf(snapshot.vectorizer, queries)
+    
+    intent_rows, intent_matrix = snapshot.intent_rows, snapshot.intent_matrix
+    picks = [(i, intent_rows[intent]) for i, intent in enumerate(intents) if intent in intent_rows]
+    if picks and weight:
+        rows, cols = zip(*picks)
+        selector = sparse.csr_matrix(
+            (np.full(len(picks), weight), (rows, cols)),
+            shape=(len(queries), intent_matrix.shape[0])
+        )
+        query_matrix = query_matrix + selector @ intent_matrix
+    return normalize(query_matrix, norm="l2", copy=False)
+
+def _top_chunks_per_document(chunk_ids: np.ndarray, scores: np.ndarray, chunks: ChunkStore,
+                             k: int, min_score: float):
+    """Pick the best chunk of each of the top k documents from one row of chunk scores.
+
+    Only a small candidate pool is selected with argpartition; the pool grows only
+    when several of the best chunks come from the same document.
+    """
+    keep = scores > min_score
+    chunk_ids, scores = chunk_ids[keep], scores[keep]
+    pool = min(len(scores), k * 4)
+    while pool > 0:
+        candidates = np.argpartition(-scores, pool - 1)[:pool] if pool < len(scores) else np.arange(len(scores))
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        picked = []
+        seen_docs = set()
+        for i in candidates:
+            doc_id = chunks.doc_ids[chunk_ids[i]]
+            if doc_id in seen_docs:
+                continue
+            seen_docs.add(doc_id)
+            picked.append((int(chunk_ids[i]), float(scores[i])))
+            if len(picked) >= k:
+                return picked
+        if pool >= len(scores):
+            return picked
+        pool = min(len(scores), pool * 4)
+    return []
+
+def _lsa_components(tfidf_matrix) -> Optional[np.ndarray]:
+    """Fit the SVD projection for a freshly fitted matrix; None if the index is too small for one"""
+    n_components = min(LSA_COMPONENTS, min(tfidf_matrix.shape) - 1)
+    if n_components < 1 or tfidf_matrix.nnz == 0:
+        return None
+    svd = TruncatedSVD(n_components=n_components, random_state=0)
+    svd.fit(tfidf_matrix)
+    return svd.components_.astype(np.float32)
+
+def _lsa_vectors(tfidf_matrix, components: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """Project chunk rows onto the SVD components and L2-normalize them"""
+    if components is None:
+        return None
+    return normalize(np.asarray(tfidf_matrix @ components.T, dtype=np.float32))
+
+def _bm25_weights(counts, idf: np.ndarray, avgdl: float):
+    """Replace each count of a chunk x term matrix with its BM25 weight (rows stay chunks)"""
+    weights = sparse.csr_matrix(counts, dtype=np.float32, copy=True)
+    doc_lengths = np.asarray(weights.sum(axis=1), dtype=np.float32).ravel()
+    tf = weights.data
+    length_norm = 1.0 - BM25_B + BM25_B * np.repeat(doc_lengths, np.diff(weights.indptr)) / (avgdl or 1.0)
+    weights.data = (idf[weights.indices] * tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)).astype(np.float32)
+    return weights
+
+def _bm25_fit(count_vectorizer: CountVectorizer, counts) -> Dict[str, Any]:
+    """Fit idf and average chunk length on a chunk x term count matrix and build CSC postings"""
+    counts = sparse.csr_matrix(counts, dtype=np.float32)
+    n_chunks = counts.shape[0]
+    df = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = np.log(1.0 + (n_chunks - df + 0.5) / (df + 0.5)).astype(np.float32)
+    avgdl = float(counts.sum()) / n_chunks if n_chunks else 0.0
+    postings = _bm25_weights(counts, idf, avgdl).tocsc()
+    postings.sort_indices()
+    return _make_bm25_index(count_vectorizer, postings, idf, avgdl)
+
+def _make_bm25_index(count_vectorizer: CountVectorizer, postings, idf: np.ndarray, avgdl: float,
+                     rows: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """Bundle postings with the statistics they were weighted by, the query vectorizer and intent term counts"""
+    intents = list(INTENT_KEYWORDS)
+    return {
+        "vectorizer": count_vectorizer,
+        "postings": postings,
+        "idf": idf,
+        "avgdl": avgdl,
+        # Postings row -> chunk position (-1 once removed); None while they match one to one
+        "rows": rows,
+        "intent_rows": {intent: i for i, intent in enumerate(intents)},
+        "intent_counts": count_vectorizer.transform([INTENT_KEYWORDS[i] for i in intents]).tocsr(),
     }
+
+def _with_term_table(count_vectorizer: CountVectorizer, terms: TermTable) -> CountVectorizer:
+    """Swap a vectorizer's vocabulary dict for a compact TermTable; transform() only needs lookups"""
+    count_vectorizer.vocabulary_ = terms
+    count_vectorizer.fixed_vocabulary_ = True
+    count_vectorizer.stop_words_ = None
+    return count_vectorizer
+
+def _bm25_index(chunks: ChunkStore) -> Dict[str, Any]:
+    """Build BM25 postings (term -> chunk ids with precomputed weights) for a chunks list"""
+    count_vectorizer = CountVectorizer(**BM25_VECTORIZER_PARAMS)
+    counts = count_vectorizer.fit_transform(chunks.texts())
+    _with_term_table(count_vectorizer, TermTable.from_vocabulary(count_vectorizer.vocabulary_))
+    return _bm25_fit(count_vectorizer, counts)
+
+def _bm25_without(index: Dict[str, Any], keep: np.ndarray) -> Dict[str, Any]:
+    """Mask out the postings rows of dropped chunks and renumber the rest; the postings are untouched"""
+    positions = np.full(len(keep), -1, dtype=np.int64)
+    positions[keep] = np.arange(np.count_nonzero(keep))
+    rows = index["rows"]
+    rows = positions if rows is None else np.where(rows >= 0, positions[rows], -1)
+    return {**index, "rows": rows}
+
+def _bm25_append(index: Dict[str, Any], texts: List[str], first_position: int) -> Dict[str, Any]:
+    """Append postings rows for new chunks, weighted with the fitted idf and average length"""
+    weights = _bm25_weights(index["vectorizer"].transform(texts), index["idf"], index["avgdl"])
+    rows = index["rows"] if index["rows"] is not None else np.arange(index["postings"].shape[0])
+    return {
+        **index,
+        "postings": sparse.vstack([index["postings"], weights], format="csc"),
+        "rows": np.concatenate([rows, np.arange(first_position, first_position + len(texts))]),
+    }
+
+def _bm25_scores(index: Dict[str, Any], queries: List[str], intents: List[Optional[str]]):
+    """Yield (chunk ids, scores) per query, touching only postings of the query's terms"""
+    query_counts = index["vectorizer"].transform(queries).tocsr().astype(np.float32)
+    picks = [(i, index["intent_rows"][intent]) for i, intent in enumerate(intents) if intent in index["intent_rows"]]
+    if picks and INTENT_EXPANSION_WEIGHT:
+        rows, cols = zip(*picks)
+        selector = sparse.csr_matrix(
+            (np.full(len(picks), INTENT_EXPANSION_WEIGHT, dtype=np.float32), (rows, cols)),
+            shape=(len(queries), index["intent_counts"].shape[0])
+        )
+        query_counts = (query_counts + selector @ index["intent_counts"]).tocsr()
+    
+    postings = index["postings"]
+    for row in range(query_counts.shape[0]):
+        start, end = query_counts.indptr[row], query_counts.indptr[row + 1]
+        chunk_ids = []
+        contributions = []
+        for term, query_weight in zip(query_counts.indices[start:end], query_counts.data[start:end]):
+            lo, hi = postings.indptr[term], postings.indptr[term + 1]
+            chunk_ids.append(postings.indices[lo:hi])
+            contributions.append(postings.data[lo:hi] * query_weight)
+        if not chunk_ids:
+            yield np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            continue
+        touched, inverse = np.unique(np.concatenate(chunk_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contributions))
+        if index["rows"] is not None:
+            touched = index["rows"][touched]
+            live = touched >= 0
+            touched, scores = touched[live], scores[live]
+        yield touched, scores
+
+def _fts_match(query: str, intent: Optional[str]) -> str:
+    """OR together the quoted non-stop-word terms of a query and its intent keywords"""
+    expansion = INTENT_KEYWORDS.get(intent, "") if INTENT_EXPANSION_WEIGHT else ""
+    words = re.findall(r"\w+", f"{query} {expansion}".lower())
+    return " OR ".join(f'"{word}"' for word in dict.fromkeys(words) if word not in ENGLISH_STOP_WORDS)
+
+def _fts_scores(chunks: CorpusChunkStore, queries: List[str], intents: List[Optional[str]]):
+    """Yield (chunk ids, scores) per query from the corpus database's FTS5 index"""
+    db = _corpus_db()
+    for query, intent in zip(queries, intents):
+        match = _fts_match(query, intent)
+        rows = db.search_corpus_chunks(match, FTS_CANDIDATES) if match else []
+        found = np.array([chunk_id for chunk_id, _ in rows], dtype=np.int64)
+        scores = np.array([score for _, score in rows], dtype=np.float32)
+        # Chunks dropped as duplicates, or ingested since this index was built, are skipped
+        positions, known = chunks.positions(found)
+        yield positions[known], scores[known]
+
+def _chunk_scores(snapshot: IndexSnapshot, queries: List[str], intents: List[Optional[str]], ranker: str,
+                  min_similarity: Optional[float] = None):
+    """Yield (chunk ids, scores, min score) per query for the chosen ranker"""
+    if ranker == "fts":
+        if not isinstance(snapshot.chunks, CorpusChunkStore):
+            raise ValueError("The fts ranker needs an index built from the corpus database (RAG_CORPUS_STORE=sqlite)")
+        for chunk_ids, scores in _fts_scores(snapshot.chunks, queries, intents):
+            yield chunk_ids, scores, min_similarity or 0.0
+        return
+    if ranker == "bm25":
+        for chunk_ids, scores in _bm25_scores(snapshot.bm25, queries, intents):
+            yield chunk_ids, scores, min_similarity or 0.0
+        return
     
-    # Build enhanced query
-    search_terms = [query]
-    if intent and intent in intent_keywords:
-        search_terms.append(intent_keywords[intent])
+    # Expand queries with related terms based on intent, then score them all together
+    query_matrix = _query_vectors(snapshot, queries, intents)
+    if ranker == "lsa":
+        if snapshot.lsa_components is not None:
+            # One dense product against the (possibly memory-mapped) chunk vectors
+            dense_queries = normalize(np.asarray(query_matrix @ snapshot.lsa_components.T, dtype=np.float32))
+            scores = dense_queries @ snapshot.lsa_vectors.T
+            chunk_ids = np.arange(scores.shape[1])
+            for row in scores:
+                yield chunk_ids, row, LSA_MIN_SIMILARITY if min_similarity is None else min_similarity
+            return
     
-    search_query = " ".join(search_terms)
+    scores = (query_matrix @ snapshot.tfidf_matrix.T).tocsr()
+    for row in range(scores.shape[0]):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        yield scores.indices[start:end], scores.data[start:end], MIN_SIMILARITY if min_similarity is None else min_similarity
+
+def _document_result(documents: List[Dict[str, Any]], chunk: Dict[str, Any], score: float) -> Dict[str, Any]:
+    """Copy a document's metadata and attach the matching chunk as its excerpt"""
+    doc = documents[chunk["doc_id"]].copy()
+    doc["similarity"] = score
     
-    # Transform query to TF-IDF vector
-    query_vector = vectorizer.transform([search_query])
+    # The best-matching chunk is the excerpt; truncate if still too long
+    excerpt = chunk["text"]
+    if len(excerpt) > EXCERPT_MAX_CHARS:
+        excerpt = excerpt[:EXCERPT_MAX_CHARS] + "..."
+    doc["excerpt"] = excerpt
+    return doc
+
+def search_documents_batch(queries: List[str], intents: Optional[List[Optional[str]]] = None,
+                           k: int = 3, ranker: str = None, snapshot: Optional[IndexSnapshot] = None,
+                           min_similarity: Optional[float] = None) -> List[List[Dict[str, Any]]]:
+    """Search documents for many queries at once.
+
+    All queries are vectorized in one transform call and scored against every chunk
+    with a single sparse matrix product (rows are L2-normalized, so the product is the
+    cosine similarity), one dense product in "lsa" mode, a postings walk in "bm25"
+    mode, or one FTS5 query each in "fts" mode (corpus store only). Returns one result
+    list per query, in order.
     
-    # Calculate cosine similarity
-    similarities = cosine_similarity(query_vector, tfidf_matrix).flatten()
+    Searches the shared index unless a snapshot (e.g. from build_index_snapshot) is given.
+    min_similarity overrides the ranker's score threshold (MIN_SIMILARITY, LSA_MIN_SIMILARITY).
+    """
+    ranker = ranker or DEFAULT_RANKER
+    if ranker not in RANKERS + CORPUS_RANKERS:
+        raise ValueError(f"Unknown ranker {ranker!r}; expected one of {RANKERS + CORPUS_RANKERS}")
+    if not queries:
+        return []
+    if intents is None:
+        intents = [None] * len(queries)
     
-    # Get top k documents with better scoring
-    top_indices = np.argsort(similarities)[-k:][::-1]
+    # One snapshot for the whole call, so a concurrent swap cannot mix two indexes
+    if snapshot is None:
+        snapshot = _index.get()
+    if snapshot.vectorizer is None:
+        return [[] for _ in queries]
     
     results = []
-    for idx in top_indices:
-        if similarities[idx] > 0.03:  # Lower threshold to include more relevant docs
-            doc = documents[idx].copy()
-            doc["similarity"] = float(similarities[idx])
-            
-            # Extract most relevant section (around 800 chars for better context)
-            content = doc["content"]
-            
-            # Try to find the most relevant paragraph
-            paragraphs = [p.strip() for p in content.split('\n\n') if len(p.strip()) > 50]
-            
-            if paragraphs:
-                # Score paragraphs by keyword relevance
-                para_scores = []
-                query_words = set(search_query.lower().split())
-                
-                for para in paragraphs:
-                    para_lower = para.lower()
-                    score = sum(1 for word in query_words if word in para_lower)
-                    para_scores.append(score)
-                
-                # Get best paragraphs
-                if max(para_scores) > 0:
-                    best_idx = para_scores.index(max(para_scores))
-                    # Include best paragraph and neighboring ones for context
-                    start_idx = max(0, best_idx - 1)
-                    end_idx = min(len(paragraphs), best_idx + 2)
-                    excerpt = "\n\n".join(paragraphs[start_idx:end_idx])
-                else:
-                    excerpt = "\n\n".join(paragraphs[:2])
-            else:
-                excerpt = content[:800]
-            
-            # Truncate if still too long
-            if len(excerpt) > 1200:
-                excerpt = excerpt[:1200] + "..."
-            
-            doc["excerpt"] = excerpt
-            results.append(doc)
-    
+    for chunk_ids, scores, min_score in _chunk_scores(snapshot, queries, intents, ranker, min_similarity):
+        picked = _top_chunks_per_document(chunk_ids, scores, snapshot.chunks, k, min_score)
+        texts = snapshot.chunks.texts_at([chunk_id for chunk_id, _ in picked])
+        if any(text is None for text in texts):
+            # Another worker changed the corpus database; skip its old chunks and catch up on the next lookup
+            _index.checked_at = 0.0
+        results.append([
+            _document_result(snapshot.documents, {"doc_id": int(snapshot.chunks.doc_ids[chunk_id]), "text": text}, score)
+            for (chunk_id, score), text in zip(picked, texts) if text is not None
+        ])
     return results
 
+def search_documents(query: str, intent: str = None, k: int = 3, ranker: str = None) -> List[Dict[str, Any]]:
+    """Search documents using semantic similarity"""
+    return search_documents_batch([query], [intent], k=k, ranker=ranker)[0]
+
 def retrieve_cards(cards: List[Dict[str, Any]], intent: str, k: int = 2) -> List[Dict[str, Any]]:
     """Retrieve skill cards by intent (original function for backwards compatibility)"""
     if not intent:
         # Return diverse cards from different categories if no intent specified
         return cards[:k]
-    matches = [c for c in cards if intent in c.get("tags", [])]
-    return matches[:k] if matches else cards[:k]
+    matches = _select_cards(cards, [intent], k)
+    return [cards[i] for i in matches] if matches else cards[:k]
+
+def _invalidate_context_cache() -> None:
+    """Drop cached retrieval results after the document index or skill cards change"""
+    global _index_generation
+    with _context_cache_lock:
+        _index_generation += 1
+        _context_cache.clear()
+
+def clear_context_cache() -> None:
+    """Empty the retrieval result cache without touching its counters"""
+    with _context_cache_lock:
+        _context_cache.clear()
+
+def context_cache_stats() -> Dict[str, int]:
+    """Hit/miss/eviction counters and current size of the retrieval result cache"""
+    with _context_cache_lock:
+        return {**_context_cache_stats, "size": len(_context_cache)}
+
+def _object_bytes(obj, seen: Optional[set] = None) -> int:
+    """Approximate heap bytes of containers, strings, arrays and sparse matrices; memory-mapped arrays count 0"""
+    if seen is None:
+        seen = set()
+    if obj is None or id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return 0 if isinstance(obj, np.memmap) else obj.nbytes
+    if sparse.issparse(obj):
+        return sum(_object_bytes(part, seen) for part in (obj.data, obj.indices, obj.indptr))
+    if isinstance(obj, (ChunkStore, CorpusChunkStore, TermTable)):
+        return 0 if obj.is_mapped() else obj.nbytes()
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (dict, MappingProxyType)):
+        size += sum(_object_bytes(key, seen) + _object_bytes(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_object_bytes(item, seen) for item in obj)
+    return size
+
+def _mapped_bytes(obj) -> int:
+    """Bytes of a memory-mapped array or chunk store (page cache, shared between processes)"""
+    if isinstance(obj, (ChunkStore, CorpusChunkStore, TermTable)):
+        return obj.nbytes() if obj.is_mapped() else 0
+    if isinstance(obj, tuple):
+        return sum(_mapped_bytes(part) for part in obj)
+    return obj.nbytes if isinstance(obj, np.memmap) else 0
+
+def memory_report(snapshot: Optional[IndexSnapshot] = None) -> Dict[str, Any]:
+    """Bytes held by each rag cache (for the shared index, or the given snapshot).
+
+    "heap" is private to this process; "memory_mapped" is backed by index files in the
+    page cache, shared between Streamlit workers and reclaimable by the OS.
+    """
+    heap, mapped = {}, {}
+    if snapshot is None:
+        snapshot = _index.peek()
+    if snapshot is not None:
+        vectorizer = snapshot.vectorizer
+        parts = {
+            "documents": snapshot.documents,
+            "chunks": snapshot.chunks,
+            "tfidf_matrix": snapshot.tfidf_matrix,
+            "vectorizer": None if vectorizer is None else (
+                getattr(vectorizer, "vocabulary_", None), getattr(vectorizer, "stop_words_", None), vectorizer.idf_
+            ),
+            "intent_vectors": snapshot.intent_matrix,
+            "lsa_components": snapshot.lsa_components,
+            "lsa_vectors": snapshot.lsa_vectors,
+            "bm25": None if snapshot.bm25 is None else (
+                getattr(snapshot.bm25["vectorizer"], "vocabulary_", None), snapshot.bm25["postings"], snapshot.bm25["idf"],
+                snapshot.bm25["rows"], snapshot.bm25["intent_counts"]
+            ),
+            "duplicates_report": snapshot.duplicates,
+        }
+        for name, obj in parts.items():
+            heap[name] = _object_bytes(obj)
+            if _mapped_bytes(obj):
+                mapped[name] = _mapped_bytes(obj)
+    heap["card_index"] = _object_bytes(_card_index_cache)
+    with _context_cache_lock:
+        heap["context_cache"] = _object_bytes(list(_context_cache.values()))
+    return {"heap": heap, "memory_mapped": mapped, "total_heap": sum(heap.values())}
+
+def _context_cache_get(key):
+    with _context_cache_lock:
+        entry = _context_cache.get(key)
+        if entry is not None and time.monotonic() - entry[0] <= CONTEXT_CACHE_TTL_SECONDS:
+            _context_cache.move_to_end(key)
+            _context_cache_stats["hits"] += 1
+            return entry[1]
+        if entry is not None:
+            del _context_cache[key]
+        _context_cache_stats["misses"] += 1
+        return None
+
+def _context_cache_put(key, value) -> None:
+    with _context_cache_lock:
+        if key[0] != _index_generation:
+            # The index was reloaded while this result was being computed
+            return
+        _context_cache[key] = (time.monotonic(), value)
+        _context_cache.move_to_end(key)
+        while len(_context_cache) > CONTEXT_CACHE_SIZE:
+            _context_cache.popitem(last=False)
+            _context_cache_stats["evictions"] += 1
 
 def retrieve_combined_context(cards: List[Dict[str, Any]], user_message: str, intent: str, k_cards: int = 2, k_docs: int = 2) -> Dict[str, Any]:
+    """Retrieve both skill cards and relevant documents, serving repeated messages from the cache"""
+    # Retrieval lowercases and tokenizes, so case and spacing differences give the same result
+    normalized = " ".join(user_message.lower().split())
+    key = (_index_generation, id(cards), DEFAULT_RANKER, normalized, intent or "", k_cards, k_docs)
+    if CONTEXT_CACHE_SIZE > 0:
+        cached = _context_cache_get(key)
+        if cached is not None:
+            return {"skill_cards": list(cached["skill_cards"]), "documents": list(cached["documents"])}
+    
+    context = _retrieve_combined_context(cards, normalized, intent, k_cards, k_docs)
+    if CONTEXT_CACHE_SIZE > 0:
+        _context_cache_put(key, context)
+        context = {"skill_cards": list(context["skill_cards"]), "documents": list(context["documents"])}
+    return context
+
+def _retrieve_combined_context(cards: List[Dict[str, Any]], user_message: str, intent: str, k_cards: int, k_docs: int) -> Dict[str, Any]:
     """Retrieve both skill cards and relevant documents"""
     # Get skill cards - if no intent, do keyword matching on user message
     if not intent:
-        # Simple keyword matching to get relevant cards
-        user_lower = user_message.lower()
-        keywords = {
-            "anxious": ["anxiety", "panic", "overwhelm", "worry"],
-            "stressed": ["stress", "overwhelm"],
-            "sad": ["sadness", "grief", "loneliness"],
-            "angry": ["anger", "frustration"],
-            "sleep": ["sleep", "tired"],
-            "test": ["test_anxiety", "anxiety"],
-            "social": ["social_anxiety", "anxiety"],
-            "focus": ["focus", "distraction"]
-        }
-        
-        # Find matching tags
-        matched_tags = set()
-        for word, tags in keywords.items():
-            if word in user_lower:
-                matched_tags.update(tags)
+        matched_tags = match_card_tags(user_message)
         
         # Get cards matching any of the tags
         if matched_tags:
-            skill_cards = []
-            for card in cards:
-                card_tags = card.get("tags", [])
-                if any(tag in card_tags for tag in matched_tags):
-                    skill_cards.append(card)
-                    if len(skill_cards) >= k_cards:
-                        break
+            selected = _select_cards(cards, matched_tags, k_cards)
             # If we didn't get enough, add more diverse cards
-            if len(skill_cards) < k_cards:
-                for card in cards:
-                    if card not in skill_cards:
-                        skill_cards.append(card)
-                        if len(skill_cards) >= k_cards:
-                            break
+            if len(selected) < k_cards:
+                chosen = set(selected)
+                selected += islice((i for i in range(len(cards)) if i not in chosen), k_cards - len(selected))
+            skill_cards = [cards[i] for i in selected]
         else:
             # No keywords matched, return diverse cards
             skill_cards = cards[:k_cards]
@@ -241,3 +2164,68 @@ def retrieve_combined_context(cards: List[Dict[str, Any]], user_message: str, in
         "skill_cards": skill_cards,
         "documents": relevant_docs
     }
+
+# Shared skill cards, loaded once per process so the card index and context cache survive reruns
+_shared_cards = None
+_shared_cards_lock = threading.Lock()
+
+# Background warm-up of the cards, index and query path, started once per server process
+_warm_up_thread = None
+_warm_up_lock = threading.Lock()
+_warm_up_state = {
+    "status": "idle",  # idle -> warming -> ready | failed
+    "error": None,
+    "seconds": None,
+    "documents": 0,
+    "chunks": 0,
+    "cards": 0,
+}
+
+def get_cards(path: str = CARDS_PATH) -> List[Dict[str, Any]]:
+    """Return the shared skill cards, loading them on first use (from the artifact when configured)"""
+    global _shared_cards
+    if _shared_cards is None:
+        with _shared_cards_lock:
+            if _shared_cards is None:
+                _shared_cards = _load_artifact_cards(ARTIFACT_DIR) if ARTIFACT_DIR else load_cards(path)
+    return _shared_cards
+
+def warm_up(data_dir: str = DATA_DIR) -> None:
+    """Load cards, build the shared index and run one query per ranker so the first turn is steady-state"""
+    _warm_up_state.update(status="warming", error=None)
+    start = time.perf_counter()
+    try:
+        cards = get_cards()
+        snapshot = _index.get(data_dir)
+        # Touch the query path too (tokenizer regexes, sparse/BLAS kernels, mmapped pages)
+        for ranker in RANKERS:
+            search_documents_batch(["warm up"], k=1, ranker=ranker, snapshot=snapshot)
+        match_card_tags("warm up")
+    except Exception as e:
+        print(f"Error warming up retrieval index: {e}")
+        _warm_up_state.update(status="failed", error=str(e))
+        return
+    _warm_up_state.update(
+        status="ready",
+        seconds=round(time.perf_counter() - start, 3),
+        documents=len(snapshot.documents),
+        chunks=len(snapshot.chunks),
+        cards=len(cards)
+    )
+
+def start_warm_up(data_dir: str = DATA_DIR) -> threading.Thread:
+    """Start warm_up on a daemon thread unless it has already been started"""
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=warm_up, args=(data_dir,), name="rag-warm-up", daemon=True)
+            _warm_up_thread.start()
+    return _warm_up_thread
+
+def is_ready() -> bool:
+    """True once warm-up has built every retrieval structure"""
+    return _warm_up_state["status"] == "ready"
+
+def readiness() -> Dict[str, Any]:
+    """Warm-up status for the UI and health checks"""
+    return dict(_warm_up_state)
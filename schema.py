@@ -102,7 +102,6 @@ COACH_OUTPUT_SCHEMA = {
                     "irritable",
                     "agitated",
                     "melancholic",
-                    "numb",
                     "disconnected",
                     "empty",
                     "desperate",
@@ -0,0 +1,127 @@
+"""Tests for conversation_context.py: summary folding thresholds and the token budget"""
+import os
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+
+# The database is created at import, so point it at a scratch directory first
+TEST_DIR = Path(tempfile.mkdtemp(prefix="context_test_"))
+os.environ["DATABASE_URL"] = f"sqlite:///{TEST_DIR / 'juno_test.db'}"
+
+import pytest
+
+import conversation_context as context
+from db_utils import load_session_summary
+
+USER_ID = 1
+
+def _history(n_messages):
+    """Alternating user/assistant messages numbered from 0"""
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"} for i in range(n_messages)]
+
+@pytest.fixture
+def summarizer(monkeypatch):
+    """Replace the model call with one that records the messages it folds"""
+    calls = []
+
+    def summarize_turns(previous_summary, messages):
+        calls.append(messages)
+        return f"{previous_summary}+{len(messages)}"
+
+    monkeypatch.setattr(context, "RECENT_TURNS", 6)
+    monkeypatch.setattr(context, "SUMMARY_BATCH_TURNS", 3)
+    monkeypatch.setattr(context, "summarize_turns", summarize_turns)
+    return calls
+
+def test_fold_waits_for_a_full_batch_beyond_the_recent_turns(summarizer):
+    session_id = str(uuid.uuid4())
+    # 6 recent turns plus 3 turns waiting is not yet past the threshold
+    assert not context.fold_older_turns(USER_ID, session_id, _history(18))
+    assert summarizer == []
+    assert context.bounded_history(USER_ID, session_id, _history(18)) == ("", _history(18))
+
+    # Everything but the last 12 messages is folded, then sent as the summary only
+    history = _history(20)
+    assert context.fold_older_turns(USER_ID, session_id, history)
+    assert summarizer == [history[:8]]
+    assert load_session_summary(USER_ID, session_id) == {"summary": "+8", "summarized_messages": 8}
+    assert context.bounded_history(USER_ID, session_id, history) == ("+8", history[8:])
+
+    # The next fold needs another full batch past the stored summary
+    assert not context.fold_older_turns(USER_ID, session_id, _history(26))
+    history = _history(28)
+    assert context.fold_older_turns(USER_ID, session_id, history)
+    assert summarizer[-1] == history[8:16]
+    assert context.bounded_history(USER_ID, session_id, history) == ("+8+8", history[16:])
+
+def test_failed_summary_is_not_stored(summarizer, monkeypatch):
+    session_id = str(uuid.uuid4())
+    monkeypatch.setattr(context, "summarize_turns", lambda previous_summary, messages: None)
+    assert not context.fold_older_turns(USER_ID, session_id, _history(20))
+    assert load_session_summary(USER_ID, session_id) is None
+
+def test_summary_of_a_reset_chat_is_dropped(summarizer):
+    session_id = str(uuid.uuid4())
+    context.fold_older_turns(USER_ID, session_id, _history(20))
+    assert context.bounded_history(USER_ID, session_id, _history(4)) == ("", _history(4))
+    assert load_session_summary(USER_ID, session_id) == {"summary": "", "summarized_messages": 0}
+
+def test_start_folding_runs_in_the_background(summarizer):
+    session_id = str(uuid.uuid4())
+    history = _history(20)
+    context.start_folding(USER_ID, session_id, history)
+    history.append({"role": "user", "content": "next turn"})
+    for thread in threading.enumerate():
+        if thread.name == f"summary-{session_id}":
+            thread.join()
+    # The fold saw the history as it was when it started
+    assert load_session_summary(USER_ID, session_id) == {"summary": "+8", "summarized_messages": 8}
+
+    # Signed-out sessions have nowhere to store a summary
+    context.start_folding(None, session_id, _history(40))
+    assert len(summarizer) == 1
+
+def test_fit_to_token_budget_drops_the_oldest_history_first():
+    system = {"role": "system", "content": "s" * 40}
+    history = [{"role": "user", "content": "u" * 40}, {"role": "assistant", "content": "a" * 40}]
+    context_message = {"role": "system", "content": "c" * 40}
+    current = {"role": "user", "content": "q" * 40}
+    messages = [system] + history + [context_message, current]
+    per_message = context.message_tokens([current])
+
+    assert context.fit_to_token_budget(messages, budget=per_message * 5) == messages
+    assert context.fit_to_token_budget(messages, budget=per_message * 4) == [system, history[1], context_message, current]
+    # System messages and the current message stay even over the budget
+    assert context.fit_to_token_budget(messages, budget=1) == [system, context_message, current]
+
+def test_build_messages_puts_stable_parts_first():
+    history = _history(2) + [{"role": "system", "content": "not part of the chat"}]
+    messages = context.build_messages("prompt", "how do I calm down?", "retrieved cards", history,
+                                      summary="they had a rough week", card_catalog="catalog")
+    assert messages == [
+        {"role": "system", "content": "prompt\n\ncatalog"},
+        {"role": "system", "content": "Summary of the earlier conversation:\nthey had a rough week"},
+        *_history(2),
+        {"role": "system", "content": "Context for this message:\n\nretrieved cards"},
+        {"role": "user", "content": "how do I calm down?"},
+    ]
+    # Parts a turn does not have are left out rather than sent empty
+    assert context.build_messages("prompt", "hi") == [
+        {"role": "system", "content": "prompt"},
+        {"role": "user", "content": "hi"},
+    ]
+
+def test_build_messages_fits_the_token_budget(monkeypatch):
+    monkeypatch.setattr(context, "CONTEXT_TOKEN_BUDGET", 60)
+    messages = context.build_messages("prompt", "hi", "cards", _history(30), summary="summary")
+    assert messages[:2] == [
+        {"role": "system", "content": "prompt"},
+        {"role": "system", "content": "Summary of the earlier conversation:\nsummary"},
+    ]
+    assert messages[-2:] == [
+        {"role": "system", "content": "Context for this message:\n\ncards"},
+        {"role": "user", "content": "hi"},
+    ]
+    assert messages[2:-2] == _history(30)[-len(messages) + 4:]
+    assert context.message_tokens(messages) <= 60
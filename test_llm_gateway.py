@@ -0,0 +1,44 @@
+"""Tests for llm_gateway.py: decoding the streamed assistant_message field"""
+import json
+
+import pytest
+
+from llm_gateway import JsonStringFieldStream
+
+REPLY = {
+    "intent": "stress",
+    "assistant_message": 'Line one\nsaid "breathe" \\ slowly\t– café \U0001F60A done',
+    "tone": "warm",
+}
+
+def _feed(stream, raw, size):
+    """Feed raw JSON in deltas of size characters; the decoded pieces in order"""
+    return [stream.feed(raw[i:i + size]) for i in range(0, len(raw), size)]
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64])
+def test_split_deltas_decode_like_json(size, ensure_ascii):
+    raw = json.dumps(REPLY, ensure_ascii=ensure_ascii)
+    stream = JsonStringFieldStream("assistant_message")
+    pieces = _feed(stream, raw, size)
+    assert "".join(pieces) == REPLY["assistant_message"]
+    assert stream.value == REPLY["assistant_message"] and stream.done
+    assert stream.text == raw
+
+def test_escape_split_across_deltas_waits_for_the_rest():
+    stream = JsonStringFieldStream("assistant_message")
+    assert stream.feed('{"assistant_message": "Hi') == "Hi"
+    assert stream.feed("\\") == ""
+    assert stream.feed("n\\u00") == "\n"
+    assert stream.feed("e9 \\ud83d") == "é "
+    assert stream.feed("\\ude0a") == "\U0001F60A"
+    assert stream.feed('!", "tone": "x"}') == "!"
+    assert stream.done and stream.value == "Hi\né \U0001F60A!"
+
+def test_text_before_the_field_is_not_decoded():
+    stream = JsonStringFieldStream("assistant_message")
+    assert stream.feed('{"intent": "other", "assistant_') == ""
+    assert stream.feed('message":"ok"') == "ok"
+    # Nothing after the closing quote belongs to the field
+    assert stream.feed(', "assistant_message": "again"}') == ""
+    assert stream.value == "ok"
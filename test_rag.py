@@ -0,0 +1,305 @@
+"""Tests for rag.py: incremental updates, the saved index and artifact verification"""
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+# rag reads its settings at import, so point every cache and database at a scratch directory first
+TEST_DIR = Path(tempfile.mkdtemp(prefix="rag_test_"))
+os.environ["RAG_INDEX_DIR"] = str(TEST_DIR / "index")
+os.environ["RAG_TEXT_CACHE_DIR"] = str(TEST_DIR / "text_cache")
+os.environ["RAG_INGEST_WORKERS"] = "1"
+os.environ["DATABASE_URL"] = f"sqlite:///{TEST_DIR / 'juno_test.db'}"
+for name in ("RAG_ARTIFACT", "RAG_CORPUS_STORE", "RAG_STREAMING_BUILD"):
+    os.environ.pop(name, None)
+
+import pytest
+
+import rag
+
+CARDS_PATH = Path(__file__).resolve().parent / rag.CARDS_PATH
+
+DOCUMENTS = {
+    "sleep.txt": (
+        "Insomnia keeps many teens awake long after bedtime, scrolling on a bright phone screen.\n\n"
+        "A steady bedtime routine, a dark room and no screens for an hour help the body rest."
+    ),
+    "exams.txt": (
+        "Finals week brings revision timetables, practice quizzes and worries about grades.\n\n"
+        "Breaking revision into short sessions with breaks makes studying for an exam calmer."
+    ),
+    "family.txt": (
+        "Parents and siblings argue about chores, curfew and house rules more than anyone admits.\n\n"
+        "Talking with family at a calm moment, not mid-argument, makes compromise more likely."
+    ),
+}
+NEW_DOCUMENT = (
+    "Skateboarding at the park after school is how some teens shake off a rough afternoon.\n\n"
+    "Learning a new skateboarding trick takes patience, falls and a lot of practice."
+)
+
+def _titles(query, ranker="tfidf"):
+    """Titles of the documents a query returns from the shared index"""
+    return [doc["title"] for doc in rag.search_documents(query, k=3, ranker=ranker)]
+
+def _ranked(snapshot, query, ranker):
+    """(title, similarity) pairs a query returns from a snapshot"""
+    results = rag.search_documents_batch([query], ["stress"], ranker=ranker, snapshot=snapshot)[0]
+    return [(doc["title"], pytest.approx(doc["similarity"], rel=1e-5)) for doc in results]
+
+def _refit():
+    """Run the full refit that picks up terms added since the vectorizer was fitted"""
+    if rag._refit_thread is not None:
+        rag._refit_thread.join()
+    rag._refit_index()
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """A small corpus and a fresh shared index with no saved index on disk"""
+    monkeypatch.setattr(rag, "_index", rag._IndexHolder())
+    # Fit the SVD too, so the "lsa" ranker is tested rather than its TF-IDF fallback
+    monkeypatch.setattr(rag, "LSA_ENABLED", True)
+    shutil.rmtree(rag.INDEX_DIR, ignore_errors=True)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for name, text in DOCUMENTS.items():
+        (docs / name).write_text(text, encoding="utf-8")
+    yield str(docs)
+    # A background refit must not publish into the next test's index
+    if rag._refit_thread is not None:
+        rag._refit_thread.join()
+
+@pytest.mark.parametrize("ranker", rag.RANKERS)
+def test_add_refresh_and_remove_document(data_dir, ranker):
+    rag.load_all_documents(data_dir)
+    assert "skateboarding" not in _titles("skateboarding trick", ranker)
+
+    new_file = Path(data_dir) / "skateboarding.txt"
+    new_file.write_text(NEW_DOCUMENT, encoding="utf-8")
+    assert rag.add_document(str(new_file), data_dir)
+    snapshot = rag._index.peek()
+    assert snapshot.documents[-1]["title"] == "skateboarding" and snapshot.delta_chunks > 0
+    # Known terms reach the new chunks at once; new ones after the refit
+    assert "skateboarding" in _titles("teens school afternoon practice", ranker)
+    _refit()
+    assert _titles("skateboarding trick", ranker)[0] == "skateboarding"
+
+    (Path(data_dir) / "sleep.txt").write_text(
+        "Homework piles up when a part-time job takes every evening of the week.", encoding="utf-8"
+    )
+    new_file.unlink()
+    changes = rag.refresh_changed(data_dir)
+    assert changes == {"added": [], "updated": [str(Path(data_dir) / "sleep.txt")], "removed": [str(new_file)]}
+    assert "skateboarding" not in _titles("skateboarding trick", ranker)
+    assert "sleep" not in _titles("insomnia bedtime phone screen", ranker)
+    _refit()
+    assert _titles("homework part-time job", ranker)[0] == "sleep"
+    assert sorted(rag._index.peek().manifest) == sorted(str(p) for p in Path(data_dir).glob("*.txt"))
+
+def test_refresh_saves_once_for_many_changes(data_dir, monkeypatch):
+    rag.load_all_documents(data_dir)
+    # No background refit, so every save counted here comes from the refresh
+    monkeypatch.setattr(rag, "REFIT_DELTA_RATIO", float("inf"))
+    saves = []
+    save = rag._save_persisted_index
+
+    def counting_save(snapshot, *args, **kwargs):
+        saves.append(snapshot)
+        return save(snapshot, *args, **kwargs)
+    monkeypatch.setattr(rag, "_save_persisted_index", counting_save)
+
+    (Path(data_dir) / "skateboarding.txt").write_text(NEW_DOCUMENT, encoding="utf-8")
+    (Path(data_dir) / "exams.txt").write_text("Homework piles up when a part-time job takes every evening.", encoding="utf-8")
+    (Path(data_dir) / "family.txt").unlink()
+    changes = rag.refresh_changed(data_dir)
+    assert [len(paths) for paths in changes.values()] == [1, 1, 1]
+    assert len(saves) == 1 and saves[0].documents == rag._index.peek().documents
+    assert rag._load_persisted_index(data_dir) is not None
+    assert rag.refresh_changed(data_dir) == {"added": [], "updated": [], "removed": []}
+    assert len(saves) == 1
+
+def test_remove_last_document(data_dir):
+    for name in ("exams.txt", "family.txt"):
+        assert rag.remove_document(str(Path(data_dir) / name), data_dir)
+    assert rag.remove_document(str(Path(data_dir) / "sleep.txt"), data_dir)
+
+    snapshot = rag._index.peek()
+    assert snapshot.documents == [] and len(snapshot.chunks) == 0 and snapshot.manifest == {}
+    for ranker in rag.RANKERS:
+        assert rag.search_documents("insomnia", ranker=ranker) == []
+    assert not rag.remove_document(str(Path(data_dir) / "sleep.txt"), data_dir)
+
+    # The emptied index grows again from its first new document
+    assert rag.add_document(str(Path(data_dir) / "sleep.txt"), data_dir)
+    assert _titles("insomnia bedtime") == ["sleep"]
+
+def test_remove_drops_manifest_entry_of_unindexed_file(data_dir):
+    copy = Path(data_dir) / "sleep_copy.txt"
+    copy.write_text(DOCUMENTS["sleep.txt"], encoding="utf-8")
+    rag.load_all_documents(data_dir)
+    snapshot = rag._index.peek()
+    assert str(copy) in snapshot.manifest
+    assert all(doc["path"] != str(copy) for doc in snapshot.documents)
+
+    copy.unlink()
+    assert rag.refresh_changed(data_dir)["removed"] == [str(copy)]
+    assert str(copy) not in rag._index.peek().manifest
+    assert rag._load_persisted_index(data_dir) is not None
+
+def test_unreadable_file_is_left_out_of_the_manifest(data_dir, monkeypatch):
+    broken = str(Path(data_dir) / "exams.txt")
+    read_document = rag._read_document
+
+    def failing_read(path):
+        if path == broken:
+            raise OSError("disk error")
+        return read_document(path)
+    monkeypatch.setattr(rag, "_read_document", failing_read)
+    rag.load_all_documents(data_dir)
+    snapshot = rag._index.peek()
+    assert broken not in snapshot.manifest
+
+    # Once the file reads again, the next refresh picks it up
+    monkeypatch.setattr(rag, "_read_document", read_document)
+    assert rag.refresh_changed(data_dir)["added"] == [broken]
+    _refit()
+    assert _titles("revision timetables quizzes")[0] == "exams"
+
+def test_text_files_are_read_without_a_pool(data_dir, monkeypatch):
+    def no_pool(workers):
+        raise AssertionError("text files need no process pool")
+    monkeypatch.setattr(rag, "_ingest_pool", no_pool)
+    paths = [str(path) for path in sorted(Path(data_dir).glob("*.txt"))]
+    failed = []
+    contents = rag.load_documents_parallel(paths + [str(Path(data_dir) / "missing.txt")], workers=4, failed=failed)
+    assert contents == [Path(path).read_text(encoding="utf-8") for path in paths] + [""]
+    assert failed == [str(Path(data_dir) / "missing.txt")]
+
+def test_saved_index_reloads(data_dir):
+    built = rag._index.get(data_dir)
+    assert rag._save_persisted_index(built) is not None
+
+    loaded = rag._load_persisted_index(data_dir)
+    assert loaded is not None
+    assert loaded.documents == built.documents
+    assert list(loaded.chunks.texts()) == list(built.chunks.texts())
+    for ranker in rag.RANKERS:
+        assert _ranked(loaded, "bedtime routine", ranker) == _ranked(built, "bedtime routine", ranker)
+
+    # A changed source file makes the saved index stale
+    (Path(data_dir) / "family.txt").write_text("Something else entirely about parents and chores.", encoding="utf-8")
+    assert rag._load_persisted_index(data_dir) is None
+
+def test_incremental_update_is_saved(data_dir):
+    rag.load_all_documents(data_dir)
+    new_file = Path(data_dir) / "skateboarding.txt"
+    new_file.write_text(NEW_DOCUMENT, encoding="utf-8")
+    rag.add_document(str(new_file), data_dir)
+
+    # This process serves the chunk text from the saved files again, not a heap copy
+    live = rag._index.peek()
+    assert live.chunks.is_mapped()
+    assert live.chunks.texts_at([len(live.chunks) - 1])[0] in NEW_DOCUMENT
+
+    # A new process starts from the saved index, which already has the document
+    loaded = rag._load_persisted_index(data_dir)
+    assert loaded is not None
+    assert str(new_file) in loaded.manifest
+    assert loaded.documents == live.documents and loaded.delta_chunks == live.delta_chunks
+    for ranker in rag.RANKERS:
+        assert _ranked(loaded, "teens school practice", ranker) == _ranked(live, "teens school practice", ranker)
+
+def test_lsa_is_fitted_only_when_enabled(data_dir, monkeypatch):
+    monkeypatch.setattr(rag, "LSA_ENABLED", False)
+    snapshot = rag.build_index_from_directory(data_dir)
+    assert snapshot.lsa_components is None and snapshot.lsa_vectors is None
+    assert _ranked(snapshot, "bedtime routine", "lsa") == _ranked(snapshot, "bedtime routine", "tfidf")
+    documents = [{"title": Path(name).stem, "path": name, "content": text} for name, text in DOCUMENTS.items()]
+    assert rag.build_index_snapshot(documents, lsa=True).lsa_components is not None
+
+def test_streaming_build_matches_documents(data_dir):
+    snapshot = rag.build_index_from_directory(data_dir, streaming=True)
+    assert isinstance(snapshot.vectorizer, rag.HashedTfidfVectorizer)
+    for ranker in rag.RANKERS:
+        results = rag.search_documents_batch(["curfew chores argue"], ranker=ranker, snapshot=snapshot)[0]
+        assert results[0]["title"] == "family"
+
+def test_artifact_hash_verification(data_dir, tmp_path, monkeypatch):
+    artifact = tmp_path / "artifact"
+    manifest = rag.build_artifact(str(artifact), data_dir, str(CARDS_PATH))
+    assert "documents.json" in manifest["files"]
+    assert rag._load_persisted_index(data_dir, str(artifact), check_sources=False) is not None
+
+    # Artifacts do not need their sources
+    shutil.rmtree(data_dir)
+    assert rag._load_persisted_index(data_dir, str(artifact), check_sources=False) is not None
+
+    with open(artifact / "documents.json", "a", encoding="utf-8") as f:
+        f.write(" ")
+    assert rag._load_persisted_index(data_dir, str(artifact), check_sources=False) is None
+    monkeypatch.setattr(rag, "ARTIFACT_DIR", str(artifact))
+    with pytest.raises(RuntimeError):
+        rag._snapshot_from_sources(data_dir)
+
+def test_missing_artifact_fails_warm_up(data_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(rag, "ARTIFACT_DIR", str(tmp_path / "missing"))
+    monkeypatch.setattr(rag, "_warm_up_state", {"status": "not_started"})
+    rag.warm_up(data_dir)
+    assert rag.readiness()["status"] == "failed"
+    assert not rag.is_ready()
+
+def test_corpus_store_add_and_remove(data_dir, monkeypatch):
+    monkeypatch.setattr(rag, "CORPUS_STORE", "sqlite")
+    rag.load_all_documents(data_dir)
+    assert _titles("insomnia bedtime phone screen", "fts")[0] == "sleep"
+
+    new_file = Path(data_dir) / "skateboarding.txt"
+    new_file.write_text(NEW_DOCUMENT, encoding="utf-8")
+    assert rag.add_document(str(new_file), data_dir)
+    assert _titles("skateboarding trick", "fts")[0] == "skateboarding"
+    # The index saved for other workers already has the new document
+    assert any(doc["title"] == "skateboarding" for doc in rag._load_persisted_index(
+        data_dir, store_sources=rag._store_manifest(rag._corpus_db().load_corpus_documents())).documents)
+
+    for name in ("sleep.txt", "exams.txt", "family.txt", "skateboarding.txt"):
+        assert rag.remove_document(str(Path(data_dir) / name), data_dir)
+    assert rag._index.peek().documents == []
+    assert rag.search_documents("skateboarding trick", ranker="fts") == []
+
+def test_corpus_store_catch_up_applies_several_documents(data_dir, monkeypatch):
+    monkeypatch.setattr(rag, "CORPUS_STORE", "sqlite")
+    rag.load_all_documents(data_dir)
+
+    # Another worker adds one file and edits an older one; this worker catches up on both at once
+    # (the new file's chunks get lower ids than the edited file's, though its document comes later)
+    (Path(data_dir) / "skateboarding.txt").write_text(NEW_DOCUMENT, encoding="utf-8")
+    rag.sync_corpus_store(data_dir)
+    (Path(data_dir) / "exams.txt").write_text(
+        "Homework piles up when a part-time job takes every evening of the week.", encoding="utf-8"
+    )
+    rag.sync_corpus_store(data_dir)
+    changes = rag._sync_with_store(data_dir)
+    assert sorted(changes["added"] + changes["updated"]) == [
+        str(Path(data_dir) / "exams.txt"), str(Path(data_dir) / "skateboarding.txt")
+    ]
+    ids = list(rag._index.peek().chunks.ids)
+    assert ids != sorted(ids)
+    assert _titles("skateboarding park", "fts")[0] == "skateboarding"
+    assert _titles("homework part-time job", "fts")[0] == "exams"
+    assert _titles("insomnia bedtime phone screen", "fts")[0] == "sleep"
+
+def test_corpus_store_refit_skips_chunks_deleted_meanwhile(data_dir, monkeypatch, capsys):
+    monkeypatch.setattr(rag, "CORPUS_STORE", "sqlite")
+    rag.load_all_documents(data_dir)
+    current = rag._index.peek()
+
+    # Another worker deletes every document before this one has caught up
+    for name in DOCUMENTS:
+        rag._corpus_db().delete_corpus_document(str(Path(data_dir) / name))
+    rag._refit_index()
+    assert rag._index.peek() is current
+    assert rag._index.checked_at == 0.0
+    assert "Error" not in capsys.readouterr().out
+
+    rag._sync_with_store(data_dir)
+    assert rag._index.peek().documents == []
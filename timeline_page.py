@@ -1,12 +1,11 @@
 import streamlit as st
 from datetime import datetime, timezone, timedelta
 import plotly.graph_objects as go
-from openai import OpenAI
-import os
 from PIL import Image
 import base64
 from io import BytesIO
 from db_utils import get_user_chat_history
+from llm_gateway import chat_completion
 
 @st.cache_data(ttl=60)
 def image_to_base64(img_path):
@@ -296,9 +295,7 @@ Provide a warm, supportive 1-2 sentence insight about their emotional journey. B
 
             # Call OpenAI API
             try:
-                client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
+                response = chat_completion(
                     messages=[
                         {"role": "system", "content": "You are Juno, a compassionate AI mental health companion for teens. Provide brief, warm, supportive insights."},
                         {"role": "user", "content": prompt}